@@ -1,10 +1,33 @@
+import json
+
+from aiohttp import web
+
 from core.coroweb import controller, get
+from core.writebehind import increment
+from model.blog import BlogModel
+from model.user import UserModel
 
 
 @controller('/v1')
 class BlogController:
 
-    @get('/blog')
+    @get('/blog', cache='public, max-age=30', etag=True)
     async def blog(self):
         return 'blog'
 
+    # the page embeds each blog's author
+    @get('/blogs', cache='public, max-age=30', etag=True, last_modified=(BlogModel, UserModel))
+    async def blogs(self, *, page: int = 1, size: int = 20):
+        # authors come with the page in the same query
+        blogs = await BlogModel.findall(order_by='id desc', limit=((max(page, 1) - 1) * size, size),
+                                        include={'user': 'joined'}, raw=True)
+        return web.json_response(blogs, dumps=lambda o: json.dumps(o, default=str))
+
+    @get('/blogs/{id}')
+    async def blog_detail(self, *, id: int):
+        blog = await BlogModel.find(id, raw=True)
+        if blog is None:
+            return web.HTTPNotFound()
+        # view counts are written behind, batched with the other views
+        increment(BlogModel, id, views=1)
+        return web.json_response(blog, dumps=lambda o: json.dumps(o, default=str))
@@ -1,6 +1,11 @@
+import logging
+
 from core.coroweb import controller, get, post
-from core.function import render
-from model.user import UserModel
+from aiohttp import web
+
+from core.function import render_async
+from core.session import get_session
+from model.user import UserModel, verify_password
 
 
 @controller('/v1/user')
@@ -8,17 +13,41 @@ class UserController:
     def __init__(self, request):
         self._request = request
 
-    @get('/users')
+    @get('/users', coalesce=True, cache='public, max-age=30', etag=True, last_modified=UserModel)
     async def get_users(self, app):
         res = await UserModel.findall(raw=True)
         # user = UserModel(nickname='jkl', email='23@qq.com')
         # res = await user.save()
         # print(res)
         # return app.render('__base__.html')
-        return render('__base__.html')
+        return await render_async('__base__.html')
 
     @post('/register')
     async def register_user(self, *, account: str, type: int = 100):
-        print('register_user....')
-        print('account: %s  type: %s' % (account, type))
+        logging.info('register_user account: %s  type: %s' % (account, type))
+        return 'success'
+
+    @post('/login', schema=UserModel)
+    async def login(self, *, email: str, password: str):
+        user = await UserModel.find(where={'email': email}, attributes=['nickname', 'password'], raw=True)
+        if user is None or not user['password'] or not await verify_password(password, user['password']):
+            return web.HTTPUnauthorized(reason='Invalid email or password')
+        session = await get_session(self._request)
+        # a new sid for the logged in session: the old one may be planted
+        session.rotate()
+        # kept in the session, so authenticated requests need no user lookup
+        session['user'] = dict(id=user['id'], nickname=user['nickname'])
+        return 'success'
+
+    @get('/me')
+    async def me(self):
+        session = await get_session(self._request)
+        if 'user' not in session:
+            return web.HTTPUnauthorized()
+        return web.json_response(session['user'])
+
+    @post('/logout')
+    async def logout(self):
+        session = await get_session(self._request)
+        session.invalidate()
         return 'success'
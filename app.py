@@ -1,9 +1,21 @@
-import os, logging
+import asyncio, functools, os, logging, shutil, tempfile
 from aiohttp import web
 from core.orm2 import create_pool, table, Model, IntegerField, StringField
 from core.coroweb import add_routes, add_static
-from config import configs
-from core.function import init_jinja2
+from config import configs, reload, on_reload, off_reload, create_config_watcher
+from core.function import init_jinja2, resize_caches
+from core.monitor import monitor_middleware, add_monitor
+from core.compress import compression_middleware
+from core.limiter import limit_middleware, set_retry_after
+from core.deadline import deadline_middleware
+from core.session import session_middleware
+from core.tasks import create_task_queue
+from core.offload import create_executors
+from core.writebehind import create_write_buffer
+from core.invalidation import create_invalidation_bus
+from core.router import RadixRouter
+from core.server import run_workers
+from core.loop import install_loop
 
 logging.basicConfig(level=logging.INFO)
 
@@ -18,16 +30,104 @@ async def middleware1(request, handler):
     except Exception as e:
         return web.Response(text=str(e))
 
-app = web.Application(middlewares=[middleware1])
 
-init_jinja2(app)
+def reload_listeners(limiter):
+    '''
+    Cleanup context applying reloaded pool size, cache and limit settings to
+    the running app.
+    '''
+    async def _reload_listeners(app):
+        def db(old, new):
+            if new.maxsize != old.maxsize and '__db__' in app:
+                asyncio.ensure_future(app['__db__'].resize(new.maxsize))
 
-add_routes(app, os.path.join(os.path.dirname(__file__), './api/v1'), 'api.v1')
+        def jinja2(old, new):
+            resize_caches(new.cache_maxsize, new.cache_ttl)
 
-add_static(app)
+        def limits(old, new):
+            set_retry_after(new.retry_after)
+            if limiter is not None:
+                limiter.configure(new.limit, new.queue, new.queue_timeout, new.retry_after)
 
-app.cleanup_ctx.append(create_pool(**configs.db))
+        listeners = dict(db=db, jinja2=jinja2, limits=limits)
+        for name, fn in listeners.items():
+            on_reload(name, fn)
+        yield
+        for name, fn in listeners.items():
+            off_reload(name, fn)
+    return _reload_listeners
+
+
+def worker_count() -> int:
+    # workers: None means one per cpu, as in the prefork master
+    return configs.server.workers or os.cpu_count() or 1
+
+
+def create_app(pool_ctx=None, bus_path=None):
+    '''
+    Build the application. pool_ctx replaces the MySQL pool cleanup context,
+    e.g. with a stand-in database for benchmarks. bus_path is the directory
+    of the workers' invalidation bus sockets, made by the prefork master.
+    '''
+    limiter = limit_middleware(**configs.limits)
+    app = web.Application(
+        router=RadixRouter() if configs.router == 'radix' else None,
+        middlewares=[
+            monitor_middleware,
+            limiter,
+            compression_middleware(**configs.compress),
+            session_middleware(**configs.session),
+            middleware1,
+            deadline_middleware(**configs.deadline)
+        ]
+    )
+
+    init_jinja2(app, auto_reload=configs.debug, **configs.jinja2)
+
+    add_routes(app, os.path.join(os.path.dirname(__file__), './api/v1'), 'api.v1',
+               manifest=configs.routes.manifest and os.path.join(os.path.dirname(__file__), configs.routes.manifest))
+
+    add_static(app, **configs.static)
+
+    add_monitor(app, **configs.monitor)
+
+    app.cleanup_ctx.append(pool_ctx or create_pool(explain=configs.debug, **configs.db))
+
+    app.cleanup_ctx.append(create_executors(**configs.offload))
+
+    # 'auto': the other workers only need telling under the prefork master
+    transport = configs.invalidation.transport
+    bus_path = configs.invalidation.path or bus_path
+    if transport == 'auto':
+        transport = 'unix' if bus_path and worker_count() > 1 else 'local'
+    app.cleanup_ctx.append(create_invalidation_bus(transport=transport, path=bus_path))
+
+    # after the pool, so buffered writes are flushed before it closes
+    app.cleanup_ctx.append(create_write_buffer(**configs.writebehind))
+
+    # after the pool, so queued jobs are drained before it closes
+    app.cleanup_ctx.append(create_task_queue(**configs.tasks))
+
+    app.cleanup_ctx.append(reload_listeners(limiter.limiter))
+    # under the prefork master SIGHUP restarts the workers instead
+    app.cleanup_ctx.append(create_config_watcher(
+        interval=configs.reload.interval, sighup=configs.reload.sighup and worker_count() == 1))
+    return app
+
+
+app = create_app()
 
 if __name__ == '__main__':
-    web.run_app(app)
+    install_loop(configs.loop)
+    if worker_count() == 1:
+        web.run_app(app, host=configs.server.host, port=configs.server.port,
+                    shutdown_timeout=configs.server.shutdown_timeout)
+    else:
+        # private (0700) directory for the bus sockets, removed with the master
+        bus_path = configs.invalidation.path or tempfile.mkdtemp(prefix='edopy-bus-')
+        try:
+            run_workers(functools.partial(create_app, bus_path=bus_path), on_reload=reload, **configs.server)
+        finally:
+            if not configs.invalidation.path:
+                shutil.rmtree(bus_path, ignore_errors=True)
 
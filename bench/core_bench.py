@@ -0,0 +1,130 @@
+'''
+Micro benchmarks of the ORM and dispatch hot paths, no MySQL server needed.
+
+    python -m bench.core_bench [--number 20000] [--repeat 5] [--filter make_sql] [--json out.json] [--compare base.json]
+
+Each case reports the best of --repeat runs of --number calls. --json writes
+machine-readable results, --compare prints the change against an earlier run.
+'''
+import argparse, asyncio, json, logging, os, platform, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from aiohttp.test_utils import make_mocked_request
+
+from bench.fakedb import FakeDatabase, install_fake_pool, user_rows
+from core.coroweb import RequestHandler, controller, get
+from core.orm2 import Op
+from model.user import UserModel
+
+
+WHERES = {
+    'eq': {'nickname': 'luu'},
+    'ops': {'id': (Op.Gt, 10), 'nickname': [(Op.Ne, 'a'), (Op.Ne, 'b')], 'email': (Op.NotNull,)},
+    'in': {'id': (Op.In, list(range(50)))},
+    'nested': {'nickname': 'luu', Op.Or: [{'id': (Op.Lt, 5)}, {'email': 'x@example.com', 'openid': (Op.IsNull,)}]},
+}
+
+
+@controller('/bench')
+class BenchController:
+    def __init__(self, request):
+        self._request = request
+
+    @get('/items/{id}')
+    async def items(self, *, id: str, page: str = '1', size: str = '20'):
+        return id
+
+
+def sync_cases() -> dict:
+    cases = dict()
+    for name, where in WHERES.items():
+        cases['make_sql_and_args[%s]' % name] = (
+            lambda w=where: UserModel._make_sql_and_args([UserModel.__select__], [], w, 'id desc', (0, 20)))
+    row = user_rows(1)[0]
+    cases['model_from_row'] = lambda: UserModel(**row)
+    cases['get_value_or_default'] = lambda: tuple(
+        map(UserModel(nickname='luu', email='x@example.com').get_value_or_default, UserModel.__fields__))
+    return cases
+
+
+def async_cases(app) -> dict:
+    handler = RequestHandler(app, (BenchController, 'items'))
+    request = make_mocked_request('GET', '/bench/items/42?page=2&size=50&extra=1', app=app,
+                                  match_info={'id': '42'})
+    db = FakeDatabase(dict(user=user_rows(20)))
+    install_fake_pool(db)
+    return {
+        'request_handler_call': lambda: handler(request),
+        'get_request_params': lambda: handler.get_request_params(request),
+        'findall[20 rows]': lambda: UserModel.findall(where=WHERES['ops'], order_by='id desc', limit=(0, 20)),
+    }
+
+
+def _result(name: str, timings: list, number: int) -> dict:
+    best = min(timings) / number
+    return dict(name=name, number=number, repeat=len(timings), best_us=best * 1e6,
+                mean_us=sum(timings) / len(timings) / number * 1e6, ops_per_sec=1 / best)
+
+
+def bench_sync(name: str, fn, number: int, repeat: int) -> dict:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        timings.append(time.perf_counter() - start)
+    return _result(name, timings, number)
+
+
+async def bench_async(name: str, fn, number: int, repeat: int) -> dict:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            await fn()
+        timings.append(time.perf_counter() - start)
+    return _result(name, timings, number)
+
+
+async def run(number: int, repeat: int, pattern: str = None) -> list:
+    from aiohttp import web
+    results = []
+    for name, fn in sync_cases().items():
+        if not pattern or pattern in name:
+            results.append(bench_sync(name, fn, number, repeat))
+    for name, fn in async_cases(web.Application()).items():
+        if not pattern or pattern in name:
+            results.append(await bench_async(name, fn, number, repeat))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--number', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--filter', help='only run cases whose name contains this')
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--compare', help='results file of an earlier run')
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    results = asyncio.run(run(args.number, args.repeat, args.filter))
+
+    base = dict()
+    if args.compare:
+        with open(args.compare) as f:
+            base = dict((r['name'], r) for r in json.load(f)['results'])
+    print('%-32s %12s %14s %10s' % ('case', 'best (us)', 'ops/s', 'change'))
+    for r in results:
+        change = ''
+        if r['name'] in base:
+            change = '%+.1f%%' % ((r['best_us'] / base[r['name']]['best_us'] - 1) * 100)
+        print('%-32s %12.3f %14.0f %10s' % (r['name'], r['best_us'], r['ops_per_sec'], change))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(dict(python=platform.python_version(), time=time.time(), results=results), f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+'''
+In-memory stand-in for an aiomysql pool, so benchmarks need no MySQL server.
+'''
+import re
+from datetime import datetime
+
+import aiomysql
+
+from core import orm2
+from core.db import MySQLDriver
+
+
+_table_re = re.compile(r'\bfrom\s+`?(\w+)`?', re.I)
+# select max(`col`) as `name` from ..., e.g. Model.last_modified()
+_max_re = re.compile(r'^\s*select\s+(?:/\*.*?\*/\s+)?max\(`?(\w+)`?\)\s+as\s+`?(\w+)`?', re.I)
+
+
+class FakeDatabase:
+    def __init__(self, tables: dict = None):
+        self.tables = tables if tables is not None else dict()
+        self.lastrowid = 0
+
+    def run(self, sql: str, args: tuple):
+        verb = sql.lstrip().split(None, 1)[0].lower()
+        if verb == 'select':
+            m = _table_re.search(sql)
+            rows = self.tables.get(m.group(1), []) if m else []
+            m = _max_re.match(sql)
+            if m:
+                values = [r[m.group(1)] for r in rows if r.get(m.group(1)) is not None]
+                return [{m.group(2): max(values) if values else None}], 0
+            return rows, 0
+        if verb == 'insert':
+            self.lastrowid += 1
+        return [], 1
+
+
+class FakeCursor:
+    def __init__(self, db: FakeDatabase, as_dict: bool):
+        self._db = db
+        self._as_dict = as_dict
+        self._rows = []
+        self.rowcount = 0
+        self.lastrowid = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    async def execute(self, sql, args=None):
+        rows, affected = self._db.run(sql, args or ())
+        self._rows = rows if self._as_dict else [tuple(r.values()) for r in rows]
+        self.rowcount = len(rows) if rows else affected
+        self.lastrowid = self._db.lastrowid
+
+    async def fetchall(self):
+        return list(self._rows)
+
+    async def fetchmany(self, size=None):
+        return self._rows[:size]
+
+
+class FakeConnection:
+    def __init__(self, db: FakeDatabase):
+        self._db = db
+
+    def cursor(self, cursor_class=None):
+        return FakeCursor(self._db, cursor_class in (aiomysql.DictCursor, aiomysql.SSDictCursor))
+
+
+class _Acquire:
+    def __init__(self, conn):
+        self._conn = conn
+
+    async def __aenter__(self):
+        return self._conn
+
+    async def __aexit__(self, *exc):
+        pass
+
+
+class FakePool:
+    def __init__(self, db: FakeDatabase):
+        self._conn = FakeConnection(db)
+
+    def acquire(self):
+        return _Acquire(self._conn)
+
+    def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
+
+
+def user_rows(count: int) -> list:
+    now = datetime(2020, 12, 27)
+    return [dict(id=i, nickname='user%s' % i, email='user%s@example.com' % i, password='x' * 60,
+                 openid='openid%s' % i, created_at=now, updated_at=now) for i in range(1, count + 1)]
+
+
+def install_fake_pool(db: FakeDatabase) -> FakePool:
+    pool = FakePool(db)
+    orm2.use_driver(MySQLDriver(pool))
+    return pool
+
+
+def create_fake_pool(db: FakeDatabase):
+    '''
+    Cleanup context to use in place of orm2.create_pool().
+    '''
+    async def _create_fake_pool(app):
+        app['__mysql_pool__'] = install_fake_pool(db)
+        yield
+        orm2.use_driver(None)
+    return _create_fake_pool
@@ -0,0 +1,147 @@
+'''
+HTTP benchmark of representative routes against a stand-in database.
+
+    python -m bench.http_bench [--loop auto|uvloop|asyncio] [--requests 2000] [--concurrency 32] [--json out.json]
+
+The app is served from a child process (python -m bench.http_bench serve) so
+the load generator does not share its event loop.
+'''
+import argparse, asyncio, json, logging, os, socket, subprocess, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import aiohttp
+
+from core.loop import install_loop
+
+# method, path, form data, expected content type and body (None: any body).
+# Errors are answered 200 with the message as text, so a response counts as
+# an error unless it is what the route really returns.
+ROUTES = (
+    ('GET', '/v1/blog', None, 'text/plain', b'blog'),
+    ('GET', '/v1/user/users', None, 'text/html', None),
+    ('POST', '/v1/user/register', {'account': 'bench', 'type': '100'}, 'text/plain', b'success'),
+)
+
+
+def serve(port: int, loop: str, rows: int):
+    from aiohttp import web
+    from bench.fakedb import FakeDatabase, create_fake_pool, user_rows
+
+    logging.basicConfig(level=logging.WARNING)
+    install_loop(loop)
+    import app as application
+    logging.getLogger().setLevel(logging.WARNING)
+    app = application.create_app(pool_ctx=create_fake_pool(FakeDatabase(dict(user=user_rows(rows)))))
+    web.run_app(app, host='127.0.0.1', port=port, print=None, access_log=None)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+async def _wait_ready(base: str, timeout: float = 15.0):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while True:
+            try:
+                async with session.get(base + '/v1/blog') as resp:
+                    await resp.read()
+                    return
+            except aiohttp.ClientError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.1)
+
+
+def _percentile(values: list, p: float) -> float:
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def _failed(resp, body: bytes, content_type: str, expected: bytes) -> bool:
+    if resp.status >= 400 or resp.content_type != content_type:
+        return True
+    return expected is not None and body != expected
+
+
+async def load(base: str, method: str, path: str, data, content_type: str, expected: bytes,
+               requests: int, concurrency: int) -> dict:
+    latencies = []
+    errors = 0
+    remaining = requests
+
+    async def worker(session):
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            async with session.request(method, base + path, data=data) as resp:
+                body = await resp.read()
+                if _failed(resp, body, content_type, expected):
+                    errors += 1
+                    if errors == 1:
+                        logging.warning('%s %s: %s %s %r' % (
+                            method, path, resp.status, resp.content_type, body[:200]))
+            latencies.append(time.perf_counter() - start)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*[worker(session) for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+    latencies.sort()
+    return dict(method=method, path=path, requests=len(latencies), errors=errors,
+                rps=len(latencies) / elapsed, p50_ms=_percentile(latencies, 50) * 1000,
+                p99_ms=_percentile(latencies, 99) * 1000)
+
+
+async def run(args) -> list:
+    base = 'http://127.0.0.1:%s' % args.port
+    await _wait_ready(base)
+    results = []
+    for method, path, data, content_type, expected in ROUTES:
+        await load(base, method, path, data, content_type, expected, min(200, args.requests), args.concurrency)
+        results.append(await load(base, method, path, data, content_type, expected, args.requests,
+                                  args.concurrency))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('mode', nargs='?', default='bench', choices=('bench', 'serve'))
+    parser.add_argument('--loop', default='auto')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--rows', type=int, default=20, help='rows in the stand-in user table')
+    parser.add_argument('--requests', type=int, default=2000, help='requests per route')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+    if args.mode == 'serve':
+        return serve(args.port, args.loop, args.rows)
+
+    args.port = args.port or _free_port()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'bench.http_bench', 'serve', '--port', str(args.port), '--loop', args.loop,
+         '--rows', str(args.rows)],
+        cwd=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'),
+        stdout=subprocess.DEVNULL)
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        server.terminate()
+        server.wait()
+    print('loop: %s' % args.loop)
+    print('%-6s %-20s %10s %10s %10s %8s' % ('method', 'path', 'req/s', 'p50 (ms)', 'p99 (ms)', 'errors'))
+    for r in results:
+        print('%-6s %-20s %10.0f %10.2f %10.2f %8s' % (
+            r['method'], r['path'], r['rps'], r['p50_ms'], r['p99_ms'], r['errors']))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(dict(loop=args.loop, concurrency=args.concurrency, results=results), f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+'''
+Route lookup cost against route count, default UrlDispatcher vs RadixRouter.
+
+    python -m bench.router_bench [--counts 10,100,1000] [--lookups 20000]
+'''
+import argparse, asyncio, os, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from aiohttp import web
+from aiohttp.test_utils import make_mocked_request
+
+from core.router import RadixRouter
+
+
+async def _handler(request):
+    return web.Response()
+
+
+def build_router(router, count: int):
+    # one controller with a list and a detail action per route pair, like @controller + @get
+    for i in range(count // 2):
+        router.add_route('GET', '/v1/controller%s/items' % i, _handler)
+        router.add_route('GET', '/v1/controller%s/items/{id}' % i, _handler)
+    router.freeze()
+    return router
+
+
+async def measure(router, paths, lookups: int) -> float:
+    requests = [make_mocked_request('GET', path) for path in paths]
+    for request in requests:
+        match_info = await router.resolve(request)
+        assert match_info.http_exception is None, request.path
+    start = time.perf_counter()
+    for i in range(lookups):
+        await router.resolve(requests[i % len(requests)])
+    return (time.perf_counter() - start) / lookups
+
+
+async def main(counts, lookups: int):
+    print('%8s %16s %16s %8s' % ('routes', 'default (us)', 'radix (us)', 'speedup'))
+    for count in counts:
+        last = count // 2 - 1
+        paths = ['/v1/controller0/items', '/v1/controller%s/items' % last, '/v1/controller%s/items/42' % last]
+        default = await measure(build_router(web.UrlDispatcher(), count), paths, lookups)
+        radix = await measure(build_router(RadixRouter(), count), paths, lookups)
+        print('%8s %16.2f %16.2f %7.1fx' % (count, default * 1e6, radix * 1e6, default / radix))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--counts', default='10,100,1000')
+    parser.add_argument('--lookups', type=int, default=20000)
+    args = parser.parse_args()
+    asyncio.run(main([int(c) for c in args.counts.split(',')], args.lookups))
@@ -1,26 +1,71 @@
-__all__ = ['configs']
+__all__ = ['configs', 'reload', 'on_reload', 'off_reload', 'create_config_watcher']
 
-from .config_default import configs as default_configs
-from .config_override import configs as override_configs
+import asyncio, importlib, json, keyword, logging, os, signal
+from collections.abc import Mapping
 
+from . import config_default, config_override
 
-class Dict(dict):
+try:
+    import tomllib
+except ImportError:
+    tomllib = None
+
+# EDOPY_DB__HOST=10.0.0.2 overrides configs.db.host
+ENV_PREFIX = 'EDOPY_'
+# json (or toml) file applied over config_override.py
+ENV_FILE = 'EDOPY_CONFIG_FILE'
+
+
+class Section(Mapping):
     '''
-    Simple dict but support access as x.y style.
+    Frozen config section. Each section gets a class of its own with one slot
+    per key, so configs.db.host is a plain slot read; it is still a mapping,
+    for **configs.db and configs.db.get('port').
     '''
-    def __init__(self, names=(), values=(), **kw):
-        super(Dict, self).__init__(**kw)
-        for k, v in zip(names, values):
-            self[k] = v
+    __slots__ = ()
 
-    def __getattr__(self, key):
+    def __setattr__(self, key, value):
+        raise AttributeError('config sections are read-only, use config.reload()')
+
+    def __getitem__(self, key):
         try:
-            return self[key]
-        except KeyError:
-            raise AttributeError(r"'Dict' object has no attribute '%s'" % key)
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self.__slots__)
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, ', '.join('%s=%r' % (k, self[k]) for k in self))
+
+
+_section_classes = dict()
+
+
+def _check_key(name, key):
+    # keys become slots: they must be identifiers and must not hide the
+    # Mapping methods (get, items, ...)
+    if not isinstance(key, str) or not key.isidentifier() or keyword.iskeyword(key) \
+            or key.startswith('_') or hasattr(Section, key):
+        raise ValueError('Invalid config key %s.%r' % (name, key))
 
-    def __setattr__(self, key, value):
-        self[key] = value
+
+def section(name, d):
+    keys = tuple(d)
+    for k in keys:
+        _check_key(name, k)
+    cls = _section_classes.get((name, keys))
+    if cls is None:
+        cls = type('%sSection' % name.title().replace('_', ''), (Section,), {'__slots__': keys})
+        _section_classes[(name, keys)] = cls
+    s = object.__new__(cls)
+    for k, v in d.items():
+        object.__setattr__(s, k, section(k, v) if isinstance(v, dict) else v)
+    return s
 
 
 def merge(defaults, override):
@@ -36,11 +81,148 @@ def merge(defaults, override):
     return r
 
 
-def to_dict(d):
-    D = Dict()
-    for k, v in d.items():
-        D[k] = to_dict(v) if isinstance(v, dict) else v
-    return D
+def coerce(default, value):
+    '''
+    Environment values are strings: convert them to the default's type.
+    '''
+    if not isinstance(value, str) or isinstance(default, str):
+        return value
+    if isinstance(default, bool):
+        return value.lower() in ('1', 'true', 'yes', 'on')
+    if isinstance(default, (int, float)):
+        return type(default)(value)
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def load_file(path):
+    with open(path, 'rb') as f:
+        if path.endswith('.toml'):
+            if tomllib is None:
+                raise RuntimeError('toml config files need python 3.11+')
+            return tomllib.load(f)
+        return json.load(f)
+
+
+def load_env(defaults, environ, prefix=ENV_PREFIX):
+    r = {}
+    for k, v in defaults.items():
+        name = prefix + k.upper()
+        if isinstance(v, dict):
+            nested = load_env(v, environ, name + '__')
+            if nested:
+                r[k] = nested
+        elif name in environ:
+            r[k] = coerce(v, environ[name])
+    return r
+
+
+def load(environ=None):
+    '''
+    config_default.py, overlaid by config_override.py, then the file named by
+    EDOPY_CONFIG_FILE, then EDOPY_* environment variables.
+    '''
+    environ = os.environ if environ is None else environ
+    d = merge(config_default.configs, config_override.configs)
+    path = environ.get(ENV_FILE)
+    if path:
+        d = merge(d, load_file(path))
+    return merge(d, load_env(d, environ))
+
+
+configs = section('configs', load())
+_listeners = dict()
+
+
+def on_reload(name, fn):
+    '''
+    Call fn(old, new) with the old and new section when a reload changes
+    configs.<name>.
+    '''
+    _listeners.setdefault(name, []).append(fn)
+
+
+def off_reload(name, fn):
+    try:
+        _listeners.get(name, []).remove(fn)
+    except ValueError:
+        pass
+
+
+def _watched_files():
+    files = [config_default.__file__, config_override.__file__]
+    if os.environ.get(ENV_FILE):
+        files.append(os.environ[ENV_FILE])
+    return files
+
+
+def reload():
+    '''
+    Re-read every source and swap in the changed sections. Sections are
+    replaced whole, so code holding one (db = configs.db) keeps a consistent
+    snapshot, and a source that fails to load leaves the running config
+    untouched. Returns the names of the changed sections.
+    '''
+    try:
+        importlib.reload(config_default)
+        importlib.reload(config_override)
+        new = section('configs', load())
+    except Exception:
+        logging.exception('config reload failed, keeping the current config')
+        return []
+    changed = [k for k in configs if k in new and new[k] != configs[k]]
+    old = dict((k, configs[k]) for k in changed)
+    for k in changed:
+        object.__setattr__(configs, k, new[k])
+    for k in changed:
+        logging.info('config %s reloaded' % k)
+        for fn in _listeners.get(k, ()):
+            try:
+                fn(old[k], new[k])
+            except Exception:
+                logging.exception('config %s reload listener failed' % k)
+    return changed
+
+
+def _mtimes():
+    r = {}
+    for path in _watched_files():
+        try:
+            r[path] = os.stat(path).st_mtime
+        except OSError:
+            r[path] = None
+    return r
+
+
+def create_config_watcher(**kw):
+    '''
+    Cleanup context calling reload() when a config file changes (polled every
+    kw['interval'] seconds, 0 to disable) and, with kw['sighup'], on SIGHUP.
+    Leave sighup off under the prefork master, which owns SIGHUP.
+    '''
+    interval = kw.get('interval', 2)
+    sighup = kw.get('sighup', False)
 
+    async def _watch():
+        mtimes = _mtimes()
+        while True:
+            await asyncio.sleep(interval)
+            current = _mtimes()
+            if current != mtimes:
+                mtimes = current
+                reload()
 
-configs = to_dict(merge(default_configs, override_configs))
+    async def _create_config_watcher(app):
+        loop = asyncio.get_event_loop()
+        task = asyncio.ensure_future(_watch()) if interval else None
+        if sighup:
+            loop.add_signal_handler(signal.SIGHUP, reload)
+        yield
+        if sighup:
+            loop.remove_signal_handler(signal.SIGHUP)
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+    return _create_config_watcher
@@ -4,14 +4,98 @@ __author__ = 'Junior Lu'
 
 configs = {
     'debug': True,
+    # 'radix' (opt-in): core.router.RadixRouter, passed through aiohttp's
+    # deprecated Application(router=...)
+    'router': 'default',
+    'loop': 'auto',
+    'server': {
+        'host': '0.0.0.0',
+        'port': 8080,
+        'workers': 1,
+        'reuse_port': False,
+        'shutdown_timeout': 60
+    },
     'db': {
+        'driver': 'mysql',
         'host': '127.0.0.1',
         'port': 3306,
         'user': 'root',
         'password': '123456',
-        'db': 'island'
+        'db': 'island',
+        'maxsize': 10,
+        'coalesce': True,
+        'last_modified_ttl': 60
+    },
+    'reload': {
+        'interval': 2,
+        'sighup': True
     },
     'session': {
-        'secret': 'easydo'
+        'secret': 'easydo',
+        'cookie_name': 'EDOSESSION',
+        'max_age': 86400,
+        'maxsize': 10000,
+        'secure': False
+    },
+    'limits': {
+        'limit': 512,
+        'queue': 1024,
+        'queue_timeout': 5,
+        'retry_after': 1
+    },
+    'deadline': {
+        'timeout': 30,
+        'header': 'X-Request-Timeout',
+        'max_timeout': 60
+    },
+    'tasks': {
+        'workers': 4,
+        'maxsize': 1000,
+        'retries': 3,
+        'backoff': 0.5,
+        'process_workers': 0,
+        'drain_timeout': 30
+    },
+    'offload': {
+        'thread_workers': None,
+        'process_workers': None,
+        'max_pending': 64,
+        'wait_timeout': 1
+    },
+    'invalidation': {
+        'transport': 'auto',
+        'path': None
+    },
+    'writebehind': {
+        'interval': 1,
+        'max_pending': 1000,
+        'upsert': False,
+        'retries': 3
+    },
+    'routes': {
+        'manifest': '.routes.json'
+    },
+    'jinja2': {
+        'render_workers': 4,
+        'cache_maxsize': 1024,
+        'cache_ttl': 5
+    },
+    'static': {
+        'precompress': True,
+        'max_age': 31536000
+    },
+    'compress': {
+        'min_size': 1024,
+        'executor_threshold': 65536,
+        'gzip_level': 6,
+        'deflate_level': 6,
+        'brotli_quality': 4
+    },
+    'monitor': {
+        'interval': 0.1,
+        'threshold': 0.1,
+        'path': '/_monitor/loop',
+        # serve the stats (with stack traces) at path
+        'expose': False
     }
 }
@@ -0,0 +1,72 @@
+import threading, time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+_missing = object()
+
+
+class LRUCache:
+    '''
+    Least recently used cache with optional per-entry ttl (seconds). Safe to
+    share between the loop and executor threads (fragments rendered off-loop).
+    '''
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, _missing) is not _missing
+
+    def get(self, key: Hashable, default=None):
+        with self._lock:
+            try:
+                expires, value = self._data[key]
+            except KeyError:
+                return default
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        '''
+        Store value for ttl seconds (the default ttl when None); no ttl at all
+        never expires, ttl <= 0 does not cache.
+        '''
+        ttl = self._ttl if ttl is None else ttl
+        with self._lock:
+            if ttl is not None and ttl <= 0:
+                self._data.pop(key, None)
+                return
+            expires = time.monotonic() + ttl if ttl is not None else None
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self._maxsize:
+                self._data.popitem(last=False)
+
+    def resize(self, maxsize: Optional[int] = None, ttl: Optional[float] = None):
+        '''
+        Change maxsize and the default ttl in place; entries over the new
+        maxsize are evicted, existing entries keep their expiry.
+        '''
+        with self._lock:
+            if maxsize is not None:
+                self._maxsize = maxsize
+            if ttl is not None:
+                self._ttl = ttl
+            while len(self._data) > self._maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
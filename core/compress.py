@@ -0,0 +1,113 @@
+import asyncio, zlib
+from typing import Optional
+
+from aiohttp import web
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# content types that are already compressed and not worth another pass
+COMPRESSED_TYPES = {
+    'application/gzip', 'application/x-gzip', 'application/zip', 'application/x-bzip2', 'application/x-xz',
+    'application/x-7z-compressed', 'application/pdf', 'application/octet-stream', 'font/woff', 'font/woff2'
+}
+COMPRESSED_PREFIXES = ('image/', 'video/', 'audio/')
+
+
+def _gzip(body: bytes, level: int) -> bytes:
+    c = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return c.compress(body) + c.flush()
+
+
+def _deflate(body: bytes, level: int) -> bytes:
+    return zlib.compress(body, level)
+
+
+def _brotli(body: bytes, level: int) -> bytes:
+    return brotli.compress(body, quality=level)
+
+
+def negotiate(accept_encoding: str, available) -> Optional[str]:
+    '''
+    Pick the encoding from available (in server preference order) with the
+    highest q-value in the Accept-Encoding header.
+    '''
+    if not accept_encoding:
+        return None
+    accepted = dict()
+    for item in accept_encoding.lower().split(','):
+        name, _, params = item.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip()] = q
+    best, best_q = None, 0.0
+    for encoding in available:
+        q = accepted.get(encoding, accepted.get('*', 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def _compressible(content_type: str) -> bool:
+    if content_type in COMPRESSED_TYPES:
+        return False
+    if content_type.startswith(COMPRESSED_PREFIXES) and content_type != 'image/svg+xml':
+        return False
+    return True
+
+
+def compression_middleware(**kw):
+    '''
+    Compress Response bodies of at least min_size bytes with br, gzip or
+    deflate. Bodies of executor_threshold bytes or more are compressed in the
+    default executor so the event loop keeps serving other requests.
+    '''
+    min_size = kw.get('min_size', 1024)
+    executor_threshold = kw.get('executor_threshold', 65536)
+    compressors = dict()
+    if brotli is not None and kw.get('brotli_quality', 4) is not None:
+        compressors['br'] = (_brotli, kw.get('brotli_quality', 4))
+    compressors['gzip'] = (_gzip, kw.get('gzip_level', 6))
+    compressors['deflate'] = (_deflate, kw.get('deflate_level', 6))
+    available = tuple(compressors.keys())
+
+    @web.middleware
+    async def _compression_middleware(request, handler):
+        response = await handler(request)
+        if type(response) is not web.Response or response.status in (204, 304) or request.method == 'HEAD':
+            return response
+        body = response.body
+        if not isinstance(body, (bytes, bytearray)) or len(body) < min_size:
+            return response
+        if 'Content-Encoding' in response.headers or not _compressible(response.content_type):
+            return response
+        vary = response.headers.get('Vary')
+        if not vary:
+            response.headers['Vary'] = 'Accept-Encoding'
+        elif 'accept-encoding' not in vary.lower():
+            response.headers['Vary'] = vary + ', Accept-Encoding'
+        encoding = negotiate(request.headers.get('Accept-Encoding', ''), available)
+        if encoding is None:
+            return response
+        compress, level = compressors[encoding]
+        if len(body) >= executor_threshold:
+            compressed = await asyncio.get_event_loop().run_in_executor(None, compress, bytes(body), level)
+        else:
+            compressed = compress(body, level)
+        if len(compressed) >= len(body):
+            return response
+        response.body = compressed
+        response.headers['Content-Encoding'] = encoding
+        etag = response.headers.get('ETag')
+        if etag and not etag.startswith('W/'):
+            response.headers['ETag'] = 'W/' + etag
+        return response
+    return _compression_middleware
@@ -1,14 +1,29 @@
-import inspect, os, functools
+import inspect, os, functools, importlib, json
 import logging
+from datetime import datetime, timezone
 from urllib import parse
 
 from aiohttp import web
-from typing import Tuple
+from typing import Tuple, Optional
 
 from aiohttp.web_request import Request
 
+from core.deadline import detach
+from core.function import etag_matches, make_etag
+from core.limiter import Overloaded, create_limiter, overloaded_response, run_limited
+from core.singleflight import SingleFlight
+from core.validate import ValidationError, compile_validator
+from core.static import setup_static
 
-def controller(root: str):
+
+def controller(root: str, **options):
+    '''
+    Define decorator @controller('/root')
+
+    options:
+        limit, queue, queue_timeout, adaptive, ...: concurrency limit shared
+            by all actions of the controller, see create_limiter().
+    '''
     if root and not root.startswith("/"):
         raise ValueError("root should be started with / or be empty")
 
@@ -16,13 +31,32 @@ def controller(root: str):
         cls.__route_root__ = root
         cls.__controller_path__ = cls.__module__
         cls.__controller_name__ = cls.__name__
+        cls.__controller_options__ = options
+        cls.__limiter__ = create_limiter(options)
         return cls
     return decorator
 
 
-def get(path):
+def get(path, **options):
     '''
     Define decorator @get('/path')
+
+    options:
+        coalesce: concurrent requests for the same path and query share one
+            execution of the action. Only for responses that are the same for
+            every client.
+        limit, queue, queue_timeout, adaptive, ...: concurrency limit of the
+            route, see create_limiter(). Requests over it get a 503.
+        cache: Cache-Control of the response, e.g. 'public, max-age=30'.
+        etag: send a weak ETag of the body and answer a matching
+            If-None-Match with 304.
+        last_modified: a Model with an updated_at column, or an async
+            function (request) -> datetime, or a tuple of them for the
+            latest of their times. Sent as Last-Modified, and a request whose
+            If-Modified-Since is not older gets a 304 before the action runs.
+        schema: a Model whose fields constrain the action's keyword-only
+            arguments of the same name (varchar length, integer range,
+            nullable), on top of their annotations. See compile_validator().
     '''
     def decorator(func):
         @functools.wraps(func)
@@ -31,13 +65,17 @@ def get(path):
         wrapper.__method__ = 'GET'
         wrapper.__route__ = path
         wrapper.__action__ = func.__name__
+        wrapper.__route_options__ = options
         return wrapper
     return decorator
 
 
-def post(path):
+def post(path, **options):
     '''
     Define decorator @post('/path')
+
+    options are the same as for @get, except coalesce and the HTTP caching
+    ones.
     '''
     def decorator(func):
         @functools.wraps(func)
@@ -46,6 +84,7 @@ def post(path):
         wrapper.__method__ = 'POST'
         wrapper.__route__ = path
         wrapper.__action__ = func.__name__
+        wrapper.__route_options__ = options
         return wrapper
     return decorator
 
@@ -55,6 +94,10 @@ def _normalize_path(path: str):
     path = path[:-1] if path.endswith('/') else path
     return path
 
+
+# 每个函数只解析一次签名
+_signature = functools.lru_cache(maxsize=None)(inspect.signature)
+
 #   POSITIONAL_ONLY 值必须是位置参数提供
 #   POSITIONAL_OR_KEYWORD 值可以作为关键字或者位置参数提供
 #   VAR_POSITIONAL 可变位置参数，对应*args
@@ -64,7 +107,7 @@ def _normalize_path(path: str):
 
 def get_required_kw_args(fn):
     args = []
-    params = inspect.signature(fn).parameters
+    params = _signature(fn).parameters
     for name, param in params.items():
         if name == 'self':
             continue
@@ -75,7 +118,7 @@ def get_required_kw_args(fn):
 
 def get_named_kw_args(fn):
     args = []
-    params = inspect.signature(fn).parameters
+    params = _signature(fn).parameters
     for name, param in params.items():
         if name == 'self':
             continue
@@ -85,7 +128,7 @@ def get_named_kw_args(fn):
 
 
 def has_var_kw_arg(fn):
-    params = inspect.signature(fn).parameters
+    params = _signature(fn).parameters
     for name, param in params.items():
         if name == 'self':
             continue
@@ -94,7 +137,7 @@ def has_var_kw_arg(fn):
 
 
 def has_request_arg(fn):
-    sig = inspect.signature(fn)
+    sig = _signature(fn)
     params = sig.parameters
     found = False
     for name, param in params.items():
@@ -109,7 +152,7 @@ def has_request_arg(fn):
 
 
 def has_app_arg(fn):
-    sig = inspect.signature(fn)
+    sig = _signature(fn)
     params = sig.parameters
     found = False
     for name, param in params.items():
@@ -120,7 +163,7 @@ def has_app_arg(fn):
 
 
 def check_arg_invalid(fn):
-    sig = inspect.signature(fn)
+    sig = _signature(fn)
     params = sig.parameters
     for name, param in params.items():
         if name == 'self' or name == 'request' or name == 'app':
@@ -129,26 +172,171 @@ def check_arg_invalid(fn):
             raise ValueError('%s parameter is not nonvariable keyword arguments in function: %s%s' % (name, fn.__name__, str(sig)))
 
 
+def get_handler_meta(controller: type, action_name: str) -> dict:
+    '''
+    Argument binding metadata of a controller action, plain data so it can be
+    stored in the route manifest.
+    '''
+    action = getattr(controller, action_name)
+    check_arg_invalid(controller)
+    check_arg_invalid(action)
+    return dict(
+        ct_has_app_arg=has_app_arg(controller),
+        ct_has_request_arg=has_request_arg(controller),
+        ct_has_var_kw_arg=bool(has_var_kw_arg(controller)),
+        ct_named_kw_args=get_named_kw_args(controller),
+        ct_required_kw_args=get_required_kw_args(controller),
+        ac_has_app_arg=has_app_arg(action),
+        ac_has_request_arg=has_request_arg(action),
+        ac_has_var_kw_arg=bool(has_var_kw_arg(action)),
+        ac_named_kw_args=get_named_kw_args(action),
+        ac_required_kw_args=get_required_kw_args(action)
+    )
+
+
+# GET requests in flight for routes declared with coalesce=True
+_route_flight = SingleFlight()
+
+
+def _copy_response(res):
+    '''
+    A prepared response can be sent only once, so every request sharing a
+    coalesced result gets its own copy.
+    '''
+    # any Response with its body in memory, HTTPExceptions (404, 400, 503) included
+    if isinstance(res, web.Response) and (res.body is None or isinstance(res.body, bytes)):
+        return web.Response(body=res.body, status=res.status, reason=res.reason, headers=res.headers.copy())
+    if isinstance(res, web.StreamResponse):
+        raise ValueError('coalesce=True routes cannot return a StreamResponse')
+    return res
+
+
+def _http_date(value: datetime) -> datetime:
+    # naive timestamps (datetime.now defaults) are local time; HTTP dates have
+    # second precision
+    return value.astimezone(timezone.utc).replace(microsecond=0)
+
+
 class RequestHandler:
-    def __init__(self, app, callback: Tuple[type, str]):
+    '''
+    callback is (controller class, action name), or (module name, class name,
+    action name) together with meta to import the controller on first call.
+    '''
+    def __init__(self, app, callback: tuple, meta: Optional[dict] = None):
         self._app = app
         self._callback = callback
-        controller = self._callback[0]
-        action_name = self._callback[1]
-        check_arg_invalid(controller)
-        check_arg_invalid(getattr(controller, action_name))
-        self._ct_has_app_arg = has_app_arg(controller)
-        self._ct_has_request_arg = has_request_arg(controller)
-        self._ct_has_var_kw_arg = has_var_kw_arg(controller)
-        self._ct_named_kw_args = get_named_kw_args(controller)
-        self._ct_required_kw_args = get_required_kw_args(controller)
-        self._ac_has_app_arg = has_app_arg(getattr(controller, action_name))
-        self._ac_has_request_arg = has_request_arg(getattr(controller, action_name))
-        self._ac_has_var_kw_arg = has_var_kw_arg(getattr(controller, action_name))
-        self._ac_named_kw_args = get_named_kw_args(getattr(controller, action_name))
-        self._ac_required_kw_args = get_required_kw_args(getattr(controller, action_name))
+        if len(callback) == 3:
+            if meta is None:
+                raise ValueError('meta is required for lazy callback: %s' % str(callback))
+        else:
+            meta = meta or get_handler_meta(*callback)
+        self._ct_has_app_arg = meta['ct_has_app_arg']
+        self._ct_has_request_arg = meta['ct_has_request_arg']
+        self._ct_has_var_kw_arg = meta['ct_has_var_kw_arg']
+        self._ct_named_kw_args = tuple(meta['ct_named_kw_args'])
+        self._ct_required_kw_args = tuple(meta['ct_required_kw_args'])
+        self._ac_has_app_arg = meta['ac_has_app_arg']
+        self._ac_has_request_arg = meta['ac_has_request_arg']
+        self._ac_has_var_kw_arg = meta['ac_has_var_kw_arg']
+        self._ac_named_kw_args = tuple(meta['ac_named_kw_args'])
+        self._ac_required_kw_args = tuple(meta['ac_required_kw_args'])
+        self._coalesce = False
+        self._limiters = ()
+        self._http_cache = False
+        if len(callback) == 2:
+            self._load_options()
+
+    def _resolve(self):
+        module_name, cls_name, action_name = self._callback
+        cls = getattr(importlib.import_module(module_name), cls_name)
+        logging.info('lazy load %s.%s.%s' % (module_name, cls_name, action_name))
+        self._callback = (cls, action_name)
+        self._load_options()
+
+    def _load_options(self):
+        options = getattr(getattr(self._callback[0], self._callback[1]), '__route_options__', None) or {}
+        self._coalesce = bool(options.get('coalesce', False))
+        limiters = [getattr(self._callback[0], '__limiter__', None), create_limiter(options)]
+        self._limiters = tuple(limiter for limiter in limiters if limiter is not None)
+        self._cache_control = options.get('cache', None)
+        self._etag = bool(options.get('etag', False))
+        self._last_modified = options.get('last_modified', None)
+        self._http_cache = bool(self._cache_control or self._etag or self._last_modified is not None)
+        self._ct_validate = compile_validator(self._callback[0], options.get('schema', None))
+        self._ac_validate = compile_validator(getattr(self._callback[0], self._callback[1]),
+                                              options.get('schema', None))
 
     async def __call__(self, request: Request):
+        if len(self._callback) == 3:
+            self._resolve()
+        if self._http_cache and request.method in ('GET', 'HEAD'):
+            return await self._conditional(request)
+        res = await self._respond(request)
+        # aiohttp only accepts responses from a handler
+        if not isinstance(res, web.StreamResponse):
+            res = web.Response(text=str(res))
+        return res
+
+    async def _conditional(self, request: Request):
+        last_modified = None
+        if self._last_modified is not None:
+            sources = self._last_modified if isinstance(self._last_modified, tuple) else (self._last_modified,)
+            for source in sources:
+                if isinstance(source, type):
+                    value = await source.last_modified()
+                else:
+                    value = await source(request)
+                if value is not None:
+                    value = _http_date(value)
+                    last_modified = value if last_modified is None else max(last_modified, value)
+            # a second that is not over yet can still see writes the validator
+            # would not tell apart, so it is neither sent nor compared
+            if last_modified is not None and last_modified >= _http_date(datetime.now(timezone.utc)):
+                last_modified = None
+            if last_modified is not None:
+                since = request.if_modified_since
+                # If-None-Match takes precedence when both are sent
+                if since is not None and 'If-None-Match' not in request.headers and last_modified <= since:
+                    return self._not_modified(None, last_modified)
+        res = await self._respond(request)
+        if not isinstance(res, web.StreamResponse):
+            res = web.Response(text=str(res))
+        if type(res) is not web.Response or res.status != 200:
+            return res
+        if self._cache_control:
+            res.headers['Cache-Control'] = self._cache_control
+        if last_modified is not None:
+            res.last_modified = last_modified
+        if self._etag and isinstance(res.body, bytes):
+            etag = res.headers.get('ETag') or 'W/%s' % make_etag(res.body)
+            res.headers['ETag'] = etag
+            if etag_matches(request.headers.get('If-None-Match'), etag):
+                return self._not_modified(etag, last_modified)
+        return res
+
+    def _not_modified(self, etag: Optional[str], last_modified: Optional[datetime]):
+        res = web.Response(status=304)
+        if etag is not None:
+            res.headers['ETag'] = etag
+        if self._cache_control:
+            res.headers['Cache-Control'] = self._cache_control
+        if last_modified is not None:
+            res.last_modified = last_modified
+        return res
+
+    async def _respond(self, request: Request):
+        if self._coalesce and request.method == 'GET':
+            # the shared call runs without the deadline of whichever request started it
+            res = await _route_flight.do((request.method, request.path_qs), detach(lambda: self._limited(request)))
+            return _copy_response(res)
+        return await self._limited(request)
+
+    async def _limited(self, request: Request, index: int = 0):
+        if index == len(self._limiters):
+            return await self._handle(request)
+        return await run_limited(self._limiters[index], self._limited, request, index + 1)
+
+    async def _handle(self, request: Request):
         con_kw = dict()
         act_kw = dict()
         if self._ct_has_var_kw_arg or self._ct_named_kw_args:
@@ -184,8 +372,18 @@ class RequestHandler:
             for name in self._ac_required_kw_args:
                 if name not in act_kw:
                     return web.HTTPBadRequest(reason='Missing argument: %s' % name)
-
-        res = await getattr(self._callback[0](**con_kw), self._callback[1])(**act_kw)
+        try:
+            if self._ct_validate is not None:
+                self._ct_validate(con_kw)
+            if self._ac_validate is not None:
+                self._ac_validate(act_kw)
+        except ValidationError as e:
+            return web.HTTPBadRequest(reason=str(e))
+
+        try:
+            res = await getattr(self._callback[0](**con_kw), self._callback[1])(**act_kw)
+        except Overloaded as e:
+            return overloaded_response(e)
         return res
 
     async def get_request_params(self, request: Request):
@@ -220,7 +418,10 @@ class RequestHandler:
         return kw
 
 
-def add_route(app, callback: Tuple[type, str]):
+ROUTE_MANIFEST_VERSION = 1
+
+
+def add_route(app, callback: Tuple[type, str]) -> Optional[dict]:
     cls = callback[0]
     action_name = callback[1]
     if type(cls) != type or not isinstance(action_name, str):
@@ -237,11 +438,14 @@ def add_route(app, callback: Tuple[type, str]):
                 raise ValueError('@get or @post not defined in %s.' % str(attr))
             path = _normalize_path(path_root) + _normalize_path(path)
             logging.info('regist metod: %s path: %s' % (method, path))
-            app.router.add_route(method, path, RequestHandler(app, callback))
-            break
+            meta = get_handler_meta(cls, action_name)
+            app.router.add_route(method, path, RequestHandler(app, callback, meta))
+            return dict(method=method, path=path, module=cls.__module__, controller=cls.__name__,
+                        action=action_name, meta=meta)
 
 
-def add_routes(app, api_path: str, module_name: str):
+def discover_routes(api_path: str, module_name: str) -> list:
+    routes = []
     for root, dirs, files in os.walk(api_path):
         file_list = []
         for file in files:
@@ -260,15 +464,86 @@ def add_routes(app, api_path: str, module_name: str):
                         if name.startswith('_') or not callable(entity):
                             continue
                         if getattr(entity, '__method__', None):
-                            add_route(app, (ct, name))
+                            routes.append((ct, name))
         for dr in dirs:
             if dr.startswith('_'):
                 continue
-            add_routes(app, os.path.join(api_path, dr), module_name + '.%s' % dr)
+            routes.extend(discover_routes(os.path.join(api_path, dr), module_name + '.%s' % dr))
         break
+    return routes
+
+
+def _source_mtimes(api_path: str) -> dict:
+    mtimes = dict()
+    for root, dirs, files in os.walk(api_path):
+        dirs[:] = [d for d in dirs if not d.startswith('_')]
+        for file in files:
+            if file.endswith('.py'):
+                path = os.path.join(root, file)
+                mtimes[os.path.relpath(path, api_path)] = os.path.getmtime(path)
+    return mtimes
 
 
-def add_static(app):
-    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../static')
-    app.router.add_static('/static/', path)
-    logging.info('add static %s => %s' % ('/static/', path))
+def load_route_manifest(manifest: str, api_path: str, module_name: str) -> Optional[list]:
+    '''
+    Routes recorded in manifest, or None when it is missing or any module
+    under api_path has been added, removed or modified since it was written.
+    '''
+    try:
+        with open(manifest, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if data.get('version') != ROUTE_MANIFEST_VERSION or data.get('module_name') != module_name:
+        return None
+    if data.get('mtimes') != _source_mtimes(api_path):
+        logging.info('route manifest %s is stale' % manifest)
+        return None
+    return data['routes']
+
+
+def save_route_manifest(manifest: str, api_path: str, module_name: str, routes: list):
+    data = dict(version=ROUTE_MANIFEST_VERSION, module_name=module_name, mtimes=_source_mtimes(api_path),
+                routes=routes)
+    tmp = '%s.%s.tmp' % (manifest, os.getpid())
+    try:
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=1)
+        os.replace(tmp, manifest)
+    except OSError as e:
+        # only a startup cache: a read-only app directory runs without it
+        logging.warning('cannot write route manifest %s: %s' % (manifest, e))
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        return
+    logging.info('write route manifest %s' % manifest)
+
+
+def add_routes(app, api_path: str, module_name: str, manifest: Optional[str] = None):
+    '''
+    Register every @controller action found under api_path. With manifest, a
+    fresh manifest file is used instead of importing and inspecting the
+    modules, which are then imported on the first request to their routes.
+    '''
+    if manifest:
+        routes = load_route_manifest(manifest, api_path, module_name)
+        if routes is not None:
+            for route in routes:
+                logging.info('regist metod: %s path: %s' % (route['method'], route['path']))
+                callback = (route['module'], route['controller'], route['action'])
+                app.router.add_route(route['method'], route['path'], RequestHandler(app, callback, route['meta']))
+            return
+    routes = []
+    for callback in discover_routes(api_path, module_name):
+        routes.append(add_route(app, callback))
+    if manifest:
+        save_route_manifest(manifest, api_path, module_name, routes)
+
+
+def add_static(app, **kw):
+    path = kw.pop('path', None) or os.path.join(os.path.dirname(os.path.abspath(__file__)), '../static')
+    prefix = kw.pop('prefix', '/static/')
+    setup_static(app, path, prefix, **kw)
+    logging.info('add static %s => %s' % (prefix, path))
@@ -0,0 +1,337 @@
+import asyncio, logging, sqlite3
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
+
+import aiomysql
+
+
+class Driver:
+    '''
+    Database backend behind orm2's select/execute/insert. SQL is written with
+    ? placeholders and translated to the driver's paramstyle.
+    '''
+    name = None
+    placeholder = '?'
+
+    @classmethod
+    async def connect(cls, **kw) -> 'Driver':
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+    async def resize(self, maxsize: int):
+        '''
+        Change the connection pool size while running, when the backend has one.
+        '''
+        pass
+
+    def translate(self, sql: str) -> str:
+        return sql if self.placeholder == '?' else sql.replace('?', self.placeholder)
+
+    def with_timeout(self, sql: str, seconds: float) -> str:
+        '''
+        sql with a server-side execution time limit, when the backend has one.
+        '''
+        return sql
+
+    async def select(self, sql: str, args: tuple, size: Optional[int] = None) -> list:
+        raise NotImplementedError
+
+    async def execute(self, sql: str, args: tuple) -> int:
+        raise NotImplementedError
+
+    async def insert(self, sql: str, args: tuple) -> int:
+        raise NotImplementedError
+
+    def iterate(self, sql: str, args: tuple, batch: int = 1000) -> AsyncIterator[dict]:
+        raise NotImplementedError
+
+    async def explain(self, sql: str, args: tuple) -> List[str]:
+        '''
+        Problems in the query plan of a select: full table scans, filesorts
+        and temporary tables.
+        '''
+        return []
+
+    def upsert_increment_sql(self, table: str, key: str, columns: List[str], rows: int) -> str:
+        '''
+        Insert rows of (key, *columns), adding the columns to the existing
+        values for keys already present.
+        '''
+        raise NotImplementedError
+
+    # schema introspection and DDL dialect, for core.migrate
+
+    async def tables(self) -> Set[str]:
+        raise NotImplementedError
+
+    async def columns(self, table: str) -> List[str]:
+        raise NotImplementedError
+
+    async def indexes(self, table: str) -> Dict[str, Tuple[Tuple[str, ...], bool]]:
+        '''
+        index name -> (columns, unique), without the primary key.
+        '''
+        raise NotImplementedError
+
+    def auto_increment_sql(self, ddl: str) -> str:
+        '''
+        Column definition of an integer primary key filled in by the database.
+        '''
+        raise NotImplementedError
+
+    def add_index_sql(self, table: str, name: str, columns: Tuple[str, ...], unique: bool) -> str:
+        return 'create %sindex `%s` on `%s` (%s)' % (
+            'unique ' if unique else '', name, table, ', '.join('`%s`' % c for c in columns))
+
+
+class MySQLDriver(Driver):
+    name = 'mysql'
+    placeholder = '%s'
+
+    def __init__(self, pool, **kw):
+        self.pool = pool
+        # connect() arguments, to recreate the pool on resize
+        self._kw = kw
+
+    @staticmethod
+    async def _create_pool(**kw):
+        return await aiomysql.create_pool(
+            host=kw.get('host', 'localhost'),
+            port=kw.get('port', 3306),
+            user=kw['user'],
+            password=kw['password'],
+            db=kw['db'],
+            charset=kw.get('charset', 'utf8'),
+            autocommit=kw.get('autocommit', True),
+            maxsize=kw.get('maxsize', 10),
+            minsize=kw.get('minsize', 1)
+        )
+
+    @classmethod
+    async def connect(cls, **kw) -> 'MySQLDriver':
+        return cls(await cls._create_pool(**kw), **kw)
+
+    async def close(self):
+        self.pool.close()
+        await self.pool.wait_closed()
+
+    async def resize(self, maxsize: int):
+        '''
+        Swap in a new pool of maxsize connections: new queries use it at once,
+        the old pool is closed once its connections in use are released.
+        '''
+        if maxsize == self.pool.maxsize:
+            return
+        self._kw = dict(self._kw, maxsize=maxsize)
+        old, self.pool = self.pool, await self._create_pool(**self._kw)
+        logging.info('mysql pool resized to %s' % maxsize)
+        old.close()
+        await old.wait_closed()
+
+    def with_timeout(self, sql: str, seconds: float) -> str:
+        if sql[:7].lower() != 'select ':
+            return sql
+        return '%s /*+ MAX_EXECUTION_TIME(%d) */ %s' % (sql[:6], max(1, int(seconds * 1000)), sql[7:])
+
+    async def select(self, sql: str, args: tuple, size: Optional[int] = None) -> list:
+        async with self.pool.acquire() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cur:
+                await cur.execute(self.translate(sql), args)
+                if size:
+                    return await cur.fetchmany(size)
+                return await cur.fetchall()
+
+    async def execute(self, sql: str, args: tuple) -> int:
+        async with self.pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(self.translate(sql), args)
+                return cur.rowcount
+
+    async def insert(self, sql: str, args: tuple) -> int:
+        async with self.pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(self.translate(sql), args)
+                return cur.lastrowid
+
+    async def explain(self, sql: str, args: tuple) -> List[str]:
+        problems = []
+        for row in await self.select('explain %s' % sql, args):
+            table = row.get('table')
+            extra = row.get('Extra') or ''
+            if row.get('type') == 'ALL':
+                problems.append('full scan of %s' % table)
+            if 'Using filesort' in extra:
+                problems.append('filesort on %s' % table)
+            if 'Using temporary' in extra:
+                problems.append('temporary table for %s' % table)
+        return problems
+
+    async def tables(self) -> Set[str]:
+        rs = await self.select('select table_name as `name` from information_schema.tables '
+                               'where table_schema = database()', ())
+        return set(r['name'] for r in rs)
+
+    async def columns(self, table: str) -> List[str]:
+        rs = await self.select('select column_name as `name` from information_schema.columns '
+                               'where table_schema = database() and table_name = ? order by ordinal_position', (table,))
+        return [r['name'] for r in rs]
+
+    async def indexes(self, table: str) -> Dict[str, Tuple[Tuple[str, ...], bool]]:
+        rs = await self.select('select index_name as `name`, column_name as `column`, non_unique as `non_unique` '
+                               'from information_schema.statistics where table_schema = database() '
+                               'and table_name = ? order by index_name, seq_in_index', (table,))
+        r = dict()
+        for row in rs:
+            if row['name'] == 'PRIMARY':
+                continue
+            columns, unique = r.get(row['name'], ((), not row['non_unique']))
+            r[row['name']] = (columns + (row['column'],), unique)
+        return r
+
+    def auto_increment_sql(self, ddl: str) -> str:
+        return '%s not null auto_increment primary key' % ddl
+
+    def upsert_increment_sql(self, table: str, key: str, columns: List[str], rows: int) -> str:
+        return 'insert into `%s` (`%s`, %s) values %s on duplicate key update %s' % (
+            table, key, ', '.join('`%s`' % c for c in columns),
+            ', '.join(['(%s)' % ', '.join(['?'] * (len(columns) + 1))] * rows),
+            ', '.join('`%s` = `%s` + values(`%s`)' % (c, c, c) for c in columns))
+
+    def add_index_sql(self, table: str, name: str, columns: Tuple[str, ...], unique: bool) -> str:
+        return 'alter table `%s` add %sindex `%s` (%s)' % (
+            table, 'unique ' if unique else '', name, ', '.join('`%s`' % c for c in columns))
+
+    async def iterate(self, sql: str, args: tuple, batch: int = 1000):
+        # unbuffered cursor: rows are read from the server as they are consumed
+        async with self.pool.acquire() as conn:
+            async with conn.cursor(aiomysql.SSDictCursor) as cur:
+                await cur.execute(self.translate(sql), args)
+                while True:
+                    rows = await cur.fetchmany(batch)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield row
+
+
+# round-trip the ORM's datetime columns through sqlite's text storage
+sqlite3.register_adapter(datetime, lambda d: d.isoformat(' '))
+sqlite3.register_converter('datetime', lambda b: datetime.fromisoformat(b.decode()))
+
+
+def _dict_factory(cursor, row):
+    return dict(zip([c[0] for c in cursor.description], row))
+
+
+class SQLiteDriver(Driver):
+    '''
+    Embedded sqlite3 database, ':memory:' by default. The connection lives on
+    a single worker thread, so calls never block the event loop and are
+    serialized the way sqlite3 requires.
+    '''
+    name = 'sqlite'
+
+    def __init__(self, conn: sqlite3.Connection, executor: ThreadPoolExecutor):
+        self.conn = conn
+        self._executor = executor
+
+    @classmethod
+    async def connect(cls, **kw) -> 'SQLiteDriver':
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite')
+        database = kw.get('db', ':memory:')
+
+        def _connect():
+            conn = sqlite3.connect(database, check_same_thread=False, isolation_level=None,
+                                   detect_types=sqlite3.PARSE_DECLTYPES)
+            conn.row_factory = _dict_factory
+            return conn
+        conn = await asyncio.get_event_loop().run_in_executor(executor, _connect)
+        logging.info('sqlite database: %s' % database)
+        return cls(conn, executor)
+
+    def _run(self, fn, *args):
+        return asyncio.get_event_loop().run_in_executor(self._executor, fn, *args)
+
+    async def close(self):
+        await self._run(self.conn.close)
+        self._executor.shutdown(wait=True)
+
+    async def select(self, sql: str, args: tuple, size: Optional[int] = None) -> list:
+        def _select():
+            cur = self.conn.execute(sql, args)
+            return cur.fetchmany(size) if size else cur.fetchall()
+        return await self._run(_select)
+
+    async def execute(self, sql: str, args: tuple) -> int:
+        return await self._run(lambda: self.conn.execute(sql, args).rowcount)
+
+    async def insert(self, sql: str, args: tuple) -> int:
+        return await self._run(lambda: self.conn.execute(sql, args).lastrowid)
+
+    async def executescript(self, script: str):
+        await self._run(self.conn.executescript, script)
+
+    async def explain(self, sql: str, args: tuple) -> List[str]:
+        problems = []
+        for row in await self.select('explain query plan %s' % sql, args):
+            detail = row['detail']
+            # SCAN t USING (COVERING) INDEX walks an index, plain SCAN t the table
+            if detail.startswith('SCAN ') and ' USING ' not in detail:
+                problems.append('full scan of %s' % detail[5:].split(' ')[0])
+            elif detail.startswith('USE TEMP B-TREE FOR ORDER BY'):
+                problems.append('filesort')
+            elif detail.startswith('USE TEMP B-TREE'):
+                problems.append('temporary table (%s)' % detail[16:].lower())
+        return problems
+
+    async def tables(self) -> Set[str]:
+        rs = await self.select("select name from sqlite_master where type = 'table'", ())
+        return set(r['name'] for r in rs)
+
+    async def columns(self, table: str) -> List[str]:
+        rs = await self.select('pragma table_info(`%s`)' % table, ())
+        return [r['name'] for r in rs]
+
+    async def indexes(self, table: str) -> Dict[str, Tuple[Tuple[str, ...], bool]]:
+        r = dict()
+        for index in await self.select('pragma index_list(`%s`)' % table, ()):
+            if index['origin'] == 'pk':
+                continue
+            rs = await self.select('pragma index_info(`%s`)' % index['name'], ())
+            r[index['name']] = (tuple(c['name'] for c in sorted(rs, key=lambda c: c['seqno'])), bool(index['unique']))
+        return r
+
+    def auto_increment_sql(self, ddl: str) -> str:
+        # only this exact type makes the column an alias of the rowid
+        return 'integer primary key'
+
+    def upsert_increment_sql(self, table: str, key: str, columns: List[str], rows: int) -> str:
+        return 'insert into `%s` (`%s`, %s) values %s on conflict (`%s`) do update set %s' % (
+            table, key, ', '.join('`%s`' % c for c in columns),
+            ', '.join(['(%s)' % ', '.join(['?'] * (len(columns) + 1))] * rows), key,
+            ', '.join('`%s` = `%s` + excluded.`%s`' % (c, c, c) for c in columns))
+
+    async def iterate(self, sql: str, args: tuple, batch: int = 1000):
+        cur = await self._run(self.conn.execute, sql, args)
+        while True:
+            rows = await self._run(cur.fetchmany, batch)
+            if not rows:
+                break
+            for row in rows:
+                yield row
+
+
+DRIVERS = {
+    MySQLDriver.name: MySQLDriver,
+    SQLiteDriver.name: SQLiteDriver
+}
+
+
+async def create_driver(**kw) -> Driver:
+    name = kw.get('driver', 'mysql')
+    if name not in DRIVERS:
+        raise ValueError('Invalid driver value: %s' % name)
+    return await DRIVERS[name].connect(**kw)
@@ -0,0 +1,98 @@
+import asyncio, logging, math
+from contextvars import ContextVar
+from typing import Optional
+
+from aiohttp import web
+
+
+# loop.time() by which the current request must be answered
+_deadline: ContextVar[Optional[float]] = ContextVar('deadline', default=None)
+_request: ContextVar[Optional[web.Request]] = ContextVar('request', default=None)
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    pass
+
+
+class RequestAbandoned(Exception):
+    pass
+
+
+def remaining() -> Optional[float]:
+    '''
+    Seconds left before the current request's deadline, None without one.
+    '''
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - asyncio.get_event_loop().time()
+
+
+def check_deadline():
+    '''
+    Raise if the current request has run out of time or its client has gone
+    away, so no more work is started on its behalf.
+    '''
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded('request deadline exceeded')
+    request = _request.get()
+    if request is not None and (request.transport is None or request.transport.is_closing()):
+        raise RequestAbandoned('client closed the connection')
+
+
+def detach(fn):
+    '''
+    Wrap fn to run without the current deadline and request, for work shared
+    between requests (each of them keeps applying its own deadline while it
+    waits).
+    '''
+    async def _detached():
+        # run as a task of its own, so this only clears the task's copy
+        _deadline.set(None)
+        _request.set(None)
+        return await fn()
+    return _detached
+
+
+def deadline_middleware(**kw):
+    '''
+    Give each request a deadline of kw['timeout'] seconds, or what the client
+    asks for in the kw['header'] header (milliseconds, capped at
+    kw['max_timeout']; ignored unless positive and finite). The handler is
+    cancelled when it passes.
+    '''
+    timeout = kw.get('timeout', None)
+    header = kw.get('header', 'X-Request-Timeout')
+    max_timeout = kw.get('max_timeout', None)
+
+    @web.middleware
+    async def _deadline_middleware(request, handler):
+        seconds = timeout
+        value = request.headers.get(header) if header else None
+        if value:
+            try:
+                asked = float(value) / 1000
+            except ValueError:
+                return web.HTTPBadRequest(reason='Invalid %s header: %s' % (header, value))
+            if asked > 0 and math.isfinite(asked):
+                seconds = asked if max_timeout is None else min(asked, max_timeout)
+        request_token = _request.set(request)
+        deadline_token = None
+        if seconds is not None:
+            deadline_token = _deadline.set(asyncio.get_event_loop().time() + seconds)
+        try:
+            if seconds is None:
+                return await handler(request)
+            return await asyncio.wait_for(handler(request), seconds)
+        except asyncio.TimeoutError:
+            logging.warning('deadline exceeded: %s %s' % (request.method, request.path))
+            return web.HTTPGatewayTimeout()
+        except RequestAbandoned:
+            logging.info('client went away: %s %s' % (request.method, request.path))
+            return web.Response(status=499, reason='Client Closed Request')
+        finally:
+            _request.reset(request_token)
+            if deadline_token is not None:
+                _deadline.reset(deadline_token)
+    return _deadline_middleware
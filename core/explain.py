@@ -0,0 +1,52 @@
+import asyncio, logging
+from collections import deque
+from typing import Optional
+
+from core.deadline import _request
+from core.db import Driver
+
+
+def _route(request) -> Optional[str]:
+    if request is None:
+        return None
+    resource = getattr(request.match_info.route, 'resource', None)
+    path = resource.canonical if resource is not None else request.path
+    return '%s %s' % (request.method, path)
+
+
+class PlanChecker:
+    '''
+    Runs each new select shape (its SQL text, args are not part of it) once
+    through the driver's explain() in the background, and reports full table
+    scans, filesorts and temporary tables together with the route that first
+    sent it. For debug mode: every shape costs one extra query.
+    '''
+    def __init__(self, driver: Driver, maxsize: int = 10000, history: int = 100):
+        self.driver = driver
+        self.maxsize = maxsize
+        self.reports = deque(maxlen=history)
+        self._seen = set()
+        self._pending = set()
+
+    def check(self, sql: str, args: tuple):
+        if sql in self._seen or len(self._seen) >= self.maxsize:
+            return
+        self._seen.add(sql)
+        task = asyncio.ensure_future(self._explain(sql, args, _route(_request.get())))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _explain(self, sql: str, args: tuple, route: Optional[str]):
+        try:
+            problems = await self.driver.explain(sql, args)
+        except Exception as e:
+            logging.info('explain failed for %s: %s' % (sql, e))
+            return
+        if problems:
+            self.reports.append(dict(sql=sql, route=route, problems=problems))
+            logging.warning('query plan: %s for %s (route: %s)' % (', '.join(problems), sql, route or '-'))
+
+    async def close(self):
+        for task in list(self._pending):
+            task.cancel()
+        await asyncio.gather(*self._pending, return_exceptions=True)
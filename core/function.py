@@ -1,14 +1,73 @@
-from jinja2 import Environment, FileSystemLoader
-import logging, os
+from jinja2 import Environment, FileSystemLoader, nodes
+from jinja2.ext import Extension
+import asyncio, hashlib, inspect, json, logging, os, time
+from concurrent.futures import ThreadPoolExecutor
 from aiohttp import web
-from typing import Optional
+from typing import Optional, Tuple
+
+from core.cache import LRUCache
 
 
 env: Optional[Environment] = None
+# same loader and options, compiled for generate_async() streaming
+async_env: Optional[Environment] = None
+
+_executor: Optional[ThreadPoolExecutor] = None
+_render_slots: Optional[asyncio.Semaphore] = None
+_max_pending = 64
+# templates whose last render took longer than this are rendered in the executor
+_offload_threshold = 0.005
+_slow_templates = set()
+
+# (template, key) -> (body, etag) of whole rendered pages
+render_cache = LRUCache(maxsize=1024, ttl=5)
+# key -> rendered markup of {% cache %} blocks
+fragment_cache = LRUCache(maxsize=1024, ttl=5)
+
+
+class FragmentCacheExtension(Extension):
+    '''
+    {% cache 'sidebar', 30 %}...{% endcache %} caches the rendered block for
+    30 seconds (the fragment cache ttl when omitted). Keys are per template.
+    '''
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [nodes.Const(parser.name), parser.parse_expression()]
+        if parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        else:
+            args.append(nodes.Const(None))
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_cache_support', args), [], [], body).set_lineno(lineno)
+
+    def _cache_support(self, template, key, ttl, caller):
+        cache = self.environment.fragment_cache
+        if cache is None:
+            return caller()
+        key = (template, key)
+        rv = cache.get(key)
+        if rv is not None:
+            return rv
+        rv = caller()
+        if inspect.isawaitable(rv):
+            return self._cache_async(cache, key, ttl, rv)
+        cache.set(key, rv, ttl)
+        return rv
+
+    async def _cache_async(self, cache, key, ttl, rv):
+        rv = await rv
+        cache.set(key, rv, ttl)
+        return rv
 
 
 def init_jinja2(app, **kw):
-    global env
+    global env, async_env, _executor, _render_slots, _max_pending, _offload_threshold, render_cache, fragment_cache
     logging.info('init jinja2...')
     options = dict(
         autoescape=kw.get('autoescape', True),
@@ -16,34 +75,192 @@ def init_jinja2(app, **kw):
         block_end_string=kw.get('block_end_string', '%}'),
         variable_start_string=kw.get('variable_start_string', '{{'),
         variable_end_string=kw.get('variable_end_string', '}}'),
-        auto_reload=kw.get('auto_reload', True)
+        auto_reload=kw.get('auto_reload', True),
+        extensions=[FragmentCacheExtension, *kw.get('extensions', [])]
     )
     path = kw.get('path', None)
     if path is None:
         path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../templates')
     logging.info('set jinja2 template path: %s' % path)
-    env = Environment(loader=FileSystemLoader(path), **options)
+    loader = FileSystemLoader(path)
+    env = Environment(loader=loader, **options)
+    async_env = Environment(loader=loader, enable_async=True, **options)
+    render_cache = LRUCache(maxsize=kw.get('cache_maxsize', 1024), ttl=kw.get('cache_ttl', 5))
+    fragment_cache = LRUCache(maxsize=kw.get('cache_maxsize', 1024), ttl=kw.get('cache_ttl', 5))
+    env.fragment_cache = fragment_cache
+    async_env.fragment_cache = fragment_cache
     filters = kw.get('filters', None)
     if filters is not None:
         for name, f in filters.items():
             env.filters[name] = f
+            async_env.filters[name] = f
+    if kw.get('precompile', True):
+        compile_templates(env)
+        compile_templates(async_env)
+    _executor = ThreadPoolExecutor(max_workers=kw.get('render_workers', 4), thread_name_prefix='render')
+    _render_slots = None
+    _max_pending = kw.get('render_max_pending', 64)
+    _offload_threshold = kw.get('offload_threshold', 0.005)
+    _slow_templates.clear()
     app['__templating__'] = env
 
-    def _render(template, data=None):
-        data = data or {}
-        resp = web.Response(body=env.get_template(template).render(**data).encode('utf-8'))
-        resp.content_type = 'text/html;charset=utf-8'
-        return resp
+    app.render = render
+    app.render_async = render_async
+    app.on_cleanup.append(_shutdown_executor)
 
-    app.render = _render
 
+def resize_caches(maxsize: Optional[int] = None, ttl: Optional[float] = None):
+    '''
+    Apply new cache_maxsize / cache_ttl settings to the render and fragment
+    caches without dropping them.
+    '''
+    render_cache.resize(maxsize, ttl)
+    fragment_cache.resize(maxsize, ttl)
 
-def render(template: str, data: Optional[dict] = None):
-    global env
-    if isinstance(env, Environment):
-        data = data or {}
-        resp = web.Response(body=env.get_template(template).render(**data).encode('utf-8'))
+
+def add_template_global(name: str, value):
+    for environment in (env, async_env):
+        if isinstance(environment, Environment):
+            environment.globals[name] = value
+
+
+def compile_templates(environment: Environment):
+    '''
+    Load every template into the environment cache, so the first request does
+    not pay for parsing and, with auto_reload off, no request stats the file.
+    '''
+    names = environment.list_templates()
+    for name in names:
+        environment.get_template(name)
+    logging.info('precompiled %s templates' % len(names))
+
+
+async def _shutdown_executor(app):
+    if _executor is not None:
+        # waiting for running renders blocks: do it off the loop
+        await asyncio.get_event_loop().run_in_executor(None, _executor.shutdown, True)
+
+
+def _render_timed(template, data: dict) -> bytes:
+    start = time.perf_counter()
+    body = template.render(**data).encode('utf-8')
+    if time.perf_counter() - start > _offload_threshold:
+        _slow_templates.add(template.name)
     else:
-        resp = web.Response(body='jinja2 is not init')
+        _slow_templates.discard(template.name)
+    return body
+
+
+def make_etag(body: bytes) -> str:
+    return '"%s"' % hashlib.md5(body).hexdigest()
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    etag = etag[2:] if etag.startswith('W/') else etag
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if (tag[2:] if tag.startswith('W/') else tag) == etag:
+            return True
+    return False
+
+
+def _html_response(body: bytes, etag: Optional[str] = None, request=None):
+    if etag is not None and request is not None and etag_matches(request.headers.get('If-None-Match'), etag):
+        return web.Response(status=304, headers={'ETag': etag})
+    resp = web.Response(body=body)
     resp.content_type = 'text/html;charset=utf-8'
+    if etag is not None:
+        resp.headers['ETag'] = etag
+    return resp
+
+
+def _render_key(template: str, data: dict, cache_key) -> Tuple[str, str]:
+    if cache_key is not None:
+        return template, cache_key
+    return template, json.dumps(data, sort_keys=True, default=str)
+
+
+def render(template: str, data: Optional[dict] = None, cache_key=None, ttl: Optional[float] = None, request=None):
+    '''
+    Render template to a text/html response. With cache_key or ttl the encoded
+    body is kept in render_cache (keyed by template and cache_key, or by data
+    when no key is given) and sent with an ETag; pass request to answer a
+    matching If-None-Match with 304.
+    '''
+    global env
+    if not isinstance(env, Environment):
+        resp = web.Response(body='jinja2 is not init')
+        resp.content_type = 'text/html;charset=utf-8'
+        return resp
+    data = data or {}
+    if cache_key is None and ttl is None:
+        return _html_response(env.get_template(template).render(**data).encode('utf-8'))
+    key = _render_key(template, data, cache_key)
+    cached = render_cache.get(key)
+    if cached is None:
+        body = env.get_template(template).render(**data).encode('utf-8')
+        cached = (body, make_etag(body))
+        render_cache.set(key, cached, ttl)
+    return _html_response(*cached, request=request)
+
+
+async def render_async(template: str, data: Optional[dict] = None, cache_key=None, ttl: Optional[float] = None,
+                       request=None):
+    '''
+    Like render(), but templates known to be slow are rendered in a bounded
+    thread pool instead of on the event loop.
+    '''
+    global _render_slots
+    if not isinstance(env, Environment):
+        return render(template, data)
+    data = data or {}
+    key = None
+    if cache_key is not None or ttl is not None:
+        key = _render_key(template, data, cache_key)
+        cached = render_cache.get(key)
+        if cached is not None:
+            return _html_response(*cached, request=request)
+    tmpl = env.get_template(template)
+    if template in _slow_templates and _executor is not None:
+        if _render_slots is None:
+            _render_slots = asyncio.Semaphore(_max_pending)
+        async with _render_slots:
+            body = await asyncio.get_event_loop().run_in_executor(_executor, _render_timed, tmpl, data)
+    else:
+        body = _render_timed(tmpl, data)
+    if key is None:
+        return _html_response(body)
+    etag = make_etag(body)
+    render_cache.set(key, (body, etag), ttl)
+    return _html_response(body, etag, request)
+
+
+async def stream_render(request, template: str, data: Optional[dict] = None, chunk_size: int = 16384):
+    '''
+    Render template with generate_async() and send it as it is produced.
+    '''
+    if not isinstance(async_env, Environment):
+        return render(template, data)
+    data = data or {}
+    tmpl = async_env.get_template(template)
+    resp = web.StreamResponse()
+    resp.content_type = 'text/html'
+    resp.charset = 'utf-8'
+    await resp.prepare(request)
+    buf = []
+    size = 0
+    async for chunk in tmpl.generate_async(**data):
+        buf.append(chunk)
+        size += len(chunk)
+        if size >= chunk_size:
+            await resp.write(''.join(buf).encode('utf-8'))
+            buf = []
+            size = 0
+    if buf:
+        await resp.write(''.join(buf).encode('utf-8'))
+    await resp.write_eof()
     return resp
@@ -0,0 +1,239 @@
+import asyncio, json, logging, os, socket
+from typing import Callable, Dict, List, Optional
+
+from core import orm2
+from core.cache import LRUCache
+
+# over this a key-level event is sent as a table-level one
+MAX_DATAGRAM = 60000
+# sent to a worker that missed events: everything may have changed
+CLEAR_ALL = json.dumps(dict(t=None, k=None)).encode('utf-8')
+# seconds between attempts to reach a worker that is not reading
+RESYNC_INTERVAL = 0.05
+
+
+class Transport:
+    '''
+    Carries encoded events to the other workers; receive is called with the
+    events of the others.
+    '''
+    async def start(self, receive: Callable[[bytes], None]):
+        pass
+
+    def send(self, data: bytes):
+        pass
+
+    async def close(self):
+        pass
+
+
+class LocalTransport(Transport):
+    '''
+    A single process: there are no other workers to tell.
+    '''
+
+
+class UnixDatagramTransport(Transport):
+    '''
+    Every worker binds a datagram socket <path>/<pid>.sock and sends each
+    event to every other socket in path, a directory only this user may
+    write to. Sockets of dead workers are removed when a send to them is
+    refused. A worker whose queue is full misses events: it is sent
+    CLEAR_ALL instead, as soon as it reads again.
+    '''
+    def __init__(self, path: str):
+        self.path = path
+        self._sock: Optional[socket.socket] = None
+        self._name = None
+        self._peers: List[str] = []
+        self._peers_mtime = None
+        # peers that missed events and are owed a CLEAR_ALL
+        self._dirty = set()
+        self._resync: Optional[asyncio.TimerHandle] = None
+
+    async def start(self, receive: Callable[[bytes], None]):
+        os.makedirs(self.path, mode=0o700, exist_ok=True)
+        st = os.stat(self.path)
+        if st.st_uid != os.getuid() or st.st_mode & 0o022:
+            raise RuntimeError('invalidation bus path %s must be owned by this user and not writable by others'
+                               % self.path)
+        self._name = os.path.join(self.path, '%s.sock' % os.getpid())
+        if os.path.exists(self._name):
+            os.unlink(self._name)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.bind(self._name)
+        self._sock.setblocking(False)
+
+        def _read():
+            while True:
+                try:
+                    data = self._sock.recv(65536)
+                except (BlockingIOError, InterruptedError):
+                    return
+                receive(data)
+        asyncio.get_event_loop().add_reader(self._sock.fileno(), _read)
+        logging.info('invalidation bus on %s' % self._name)
+
+    def _refresh_peers(self):
+        mtime = os.stat(self.path).st_mtime
+        if mtime != self._peers_mtime:
+            self._peers_mtime = mtime
+            self._peers = [os.path.join(self.path, name) for name in os.listdir(self.path)
+                           if name.endswith('.sock') and os.path.join(self.path, name) != self._name]
+
+    def send(self, data: bytes):
+        self._refresh_peers()
+        for peer in self._peers:
+            # CLEAR_ALL, still owed, covers this event too
+            if peer not in self._dirty:
+                self._send(peer, data)
+
+    def _send(self, peer: str, data: bytes) -> bool:
+        try:
+            self._sock.sendto(data, peer)
+        except (ConnectionRefusedError, FileNotFoundError):
+            # a worker that died without cleaning up
+            self._dirty.discard(peer)
+            try:
+                os.unlink(peer)
+            except OSError:
+                pass
+        except BlockingIOError:
+            if peer not in self._dirty:
+                logging.warning('invalidation bus: %s is not reading, it will be sent a clear all' % peer)
+                self._dirty.add(peer)
+            if self._resync is None:
+                self._resync = asyncio.get_event_loop().call_later(RESYNC_INTERVAL, self._send_resync)
+            return False
+        return True
+
+    def _send_resync(self):
+        self._resync = None
+        for peer in list(self._dirty):
+            if self._send(peer, CLEAR_ALL):
+                self._dirty.discard(peer)
+
+    async def close(self):
+        if self._sock is None:
+            return
+        if self._resync is not None:
+            self._resync.cancel()
+        asyncio.get_event_loop().remove_reader(self._sock.fileno())
+        self._sock.close()
+        try:
+            os.unlink(self._name)
+        except OSError:
+            pass
+
+
+class InvalidationBus:
+    '''
+    Publishes which rows changed, by table and primary keys (None for "any
+    row"), to subscribers in this process and, through the transport, in the
+    other workers. The ORM write paths, deletes included, publish through
+    orm2.on_write; changes from the other workers move orm2's Last-Modified
+    validators.
+    '''
+    def __init__(self, transport: Optional[Transport] = None):
+        self.transport = transport or LocalTransport()
+        self._subscribers: Dict[str, list] = dict()
+
+    def subscribe(self, table: str, fn: Callable[[str, Optional[list]], None]):
+        '''
+        Call fn(table, keys) on changes of table, '*' for every table.
+        '''
+        self._subscribers.setdefault(table, []).append(fn)
+
+    def bind_cache(self, table: str, cache: LRUCache):
+        '''
+        Keep a cache of table rows keyed by primary key fresh: changed keys
+        are deleted, a table-level event clears it.
+        '''
+        def _invalidate(_, keys):
+            if keys is None:
+                cache.clear()
+            else:
+                for key in keys:
+                    cache.delete(key)
+        self.subscribe(table, _invalidate)
+
+    def publish(self, table: str, keys: Optional[list] = None):
+        self._deliver(table, keys)
+        data = json.dumps(dict(t=table, k=keys), default=str).encode('utf-8')
+        if len(data) > MAX_DATAGRAM:
+            data = json.dumps(dict(t=table, k=None)).encode('utf-8')
+        self.transport.send(data)
+
+    def _receive(self, data: bytes):
+        try:
+            event = json.loads(data.decode('utf-8'))
+        except ValueError:
+            logging.warning('invalidation bus: bad event %r' % data[:100])
+            return
+        self._deliver(event['t'], event['k'])
+
+    def _deliver(self, table: Optional[str], keys: Optional[list]):
+        if table is None:
+            # CLEAR_ALL: every subscriber, with no keys
+            for name, fns in list(self._subscribers.items()):
+                for fn in fns:
+                    self._call(fn, name, None)
+            return
+        for fn in self._subscribers.get(table, []) + self._subscribers.get('*', []):
+            self._call(fn, table, keys)
+
+    def _call(self, fn, table: str, keys: Optional[list]):
+        try:
+            fn(table, keys)
+        except Exception:
+            logging.exception('invalidation subscriber failed for %s' % table)
+
+    async def start(self):
+        await self.transport.start(self._receive)
+        self.subscribe('*', orm2.touch)
+        orm2.on_write(self.publish)
+
+    async def close(self):
+        orm2.off_write(self.publish)
+        self._subscribers.get('*', []).remove(orm2.touch)
+        await self.transport.close()
+
+
+_bus: Optional[InvalidationBus] = None
+
+
+def create_transport(**kw) -> Transport:
+    name = kw.get('transport', None) or 'local'
+    if name == 'local':
+        return LocalTransport()
+    if name == 'unix':
+        # a private directory, e.g. made by the prefork master with mkdtemp()
+        if not kw.get('path', None):
+            raise ValueError('the unix transport needs a path')
+        return UnixDatagramTransport(kw['path'])
+    raise ValueError('Invalid transport value: %s' % name)
+
+
+def create_invalidation_bus(**kw):
+    '''
+    Cleanup context running an InvalidationBus over kw['transport'] ('local',
+    'unix' or a Transport instance), published to by the ORM's writes.
+    '''
+    async def _create_invalidation_bus(app):
+        global _bus
+        transport = kw.get('transport', None)
+        bus = InvalidationBus(transport if isinstance(transport, Transport) else create_transport(**kw))
+        await bus.start()
+        _bus = bus
+        app['__bus__'] = bus
+        yield
+        await bus.close()
+        if _bus is bus:
+            _bus = None
+    return _create_invalidation_bus
+
+
+def get_bus() -> InvalidationBus:
+    if _bus is None:
+        raise RuntimeError('invalidation bus is not running')
+    return _bus
@@ -0,0 +1,189 @@
+import asyncio, logging, time
+from collections import deque
+from typing import Optional
+
+from aiohttp import web
+
+
+# Retry-After of 503s for an Overloaded without its own, from configs.limits
+_retry_after = 1
+
+
+class Overloaded(Exception):
+    '''
+    Raised when there is no capacity for a request; retry_after (seconds) is
+    sent back as Retry-After, the configured default when None.
+    '''
+    def __init__(self, message: str = 'Service Unavailable', retry_after: Optional[int] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def set_retry_after(seconds: int):
+    global _retry_after
+    _retry_after = seconds
+
+
+def overloaded_response(e: Overloaded):
+    retry_after = _retry_after if e.retry_after is None else e.retry_after
+    return web.HTTPServiceUnavailable(reason=str(e), headers={'Retry-After': str(retry_after)})
+
+
+class ConcurrencyLimiter:
+    '''
+    At most limit holders at a time. Up to queue callers wait in line for at
+    most queue_timeout seconds; anything beyond that fails fast with
+    Overloaded. With adaptive=True the limit moves between min_limit and
+    max_limit: it grows by one while the average latency of a window of
+    requests stays under target_latency (twice the best window seen when not
+    given) and shrinks by 10% when it does not.
+    '''
+    def __init__(self, limit: int, queue: int = 0, queue_timeout: Optional[float] = None,
+                 adaptive: bool = False, min_limit: int = 1, max_limit: Optional[int] = None,
+                 target_latency: Optional[float] = None, window: int = 50, retry_after: int = 1):
+        self.limit = limit
+        self.queue = queue
+        self.queue_timeout = queue_timeout
+        self.adaptive = adaptive
+        self.min_limit = min_limit
+        self.max_limit = max_limit or limit * 4
+        self.target_latency = target_latency
+        self.window = window
+        self.retry_after = retry_after
+        self.active = 0
+        self.rejected = 0
+        self._waiters = deque()
+        self._window_count = 0
+        self._window_total = 0.0
+        self._best_latency = None
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self):
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return
+        if len(self._waiters) >= self.queue:
+            self.rejected += 1
+            raise Overloaded('over capacity: %s active, %s waiting' % (self.active, len(self._waiters)),
+                             self.retry_after)
+        fut = asyncio.get_event_loop().create_future()
+        self._waiters.append(fut)
+        try:
+            # the slot is handed over by release(), active is not decremented in between
+            await asyncio.wait_for(fut, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise Overloaded('queue timeout after %ss' % self.queue_timeout, self.retry_after)
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self._release_slot()
+            raise
+        finally:
+            if not fut.done() or fut.cancelled():
+                try:
+                    self._waiters.remove(fut)
+                except ValueError:
+                    pass
+
+    def release(self, latency: Optional[float] = None):
+        if self.adaptive and latency is not None:
+            self._observe(latency)
+        self._release_slot()
+
+    def _release_slot(self):
+        while self._waiters and self.active <= self.limit:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self.active -= 1
+
+    def _observe(self, latency: float):
+        self._window_count += 1
+        self._window_total += latency
+        if self._window_count < self.window:
+            return
+        average = self._window_total / self._window_count
+        self._window_count = 0
+        self._window_total = 0.0
+        if self._best_latency is None or average < self._best_latency:
+            self._best_latency = average
+        target = self.target_latency or self._best_latency * 2
+        if average > target:
+            limit = max(self.min_limit, int(self.limit * 0.9))
+        else:
+            limit = min(self.max_limit, self.limit + 1)
+        if limit != self.limit:
+            logging.debug('concurrency limit %s -> %s (latency %.4fs)' % (self.limit, limit, average))
+            self.limit = limit
+
+    def configure(self, limit: Optional[int] = None, queue: Optional[int] = None,
+                  queue_timeout: Optional[float] = None, retry_after: Optional[int] = None):
+        '''
+        Change the limits while running; a higher limit lets waiters in at once.
+        '''
+        if limit is not None:
+            self.limit = limit
+            self.max_limit = max(self.max_limit, limit)
+        if queue is not None:
+            self.queue = queue
+        if queue_timeout is not None:
+            self.queue_timeout = queue_timeout
+        if retry_after is not None:
+            self.retry_after = retry_after
+        while self._waiters and self.active < self.limit:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                self.active += 1
+                fut.set_result(None)
+
+
+def create_limiter(options: dict) -> Optional[ConcurrencyLimiter]:
+    '''
+    Limiter from route or controller options, None without a limit.
+    '''
+    limit = options.get('limit', None)
+    if not limit:
+        return None
+    return ConcurrencyLimiter(
+        limit,
+        queue=options.get('queue', 0),
+        queue_timeout=options.get('queue_timeout', None),
+        adaptive=options.get('adaptive', False),
+        min_limit=options.get('min_limit', 1),
+        max_limit=options.get('max_limit', None),
+        target_latency=options.get('target_latency', None),
+        retry_after=options.get('retry_after', 1)
+    )
+
+
+async def run_limited(limiter: ConcurrencyLimiter, fn, *args):
+    try:
+        await limiter.acquire()
+    except Overloaded as e:
+        return overloaded_response(e)
+    start = time.monotonic()
+    try:
+        return await fn(*args)
+    finally:
+        limiter.release(time.monotonic() - start)
+
+
+def limit_middleware(**kw):
+    '''
+    Global concurrency limit over every request, from configs.limits.
+    '''
+    limiter = create_limiter(kw)
+    set_retry_after(kw.get('retry_after', 1))
+
+    @web.middleware
+    async def _limit_middleware(request, handler):
+        if limiter is None:
+            return await handler(request)
+        return await run_limited(limiter, handler, request)
+    # for configure() on a config reload
+    _limit_middleware.limiter = limiter
+    return _limit_middleware
@@ -0,0 +1,25 @@
+import asyncio, logging
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+
+def install_loop(name: str = 'auto') -> str:
+    '''
+    Select the event loop implementation: 'uvloop', 'asyncio', or 'auto' for
+    uvloop when it is installed. Returns the name of the installed backend.
+    '''
+    if name not in ('auto', 'uvloop', 'asyncio'):
+        raise ValueError('Invalid loop value: %s' % name)
+    if name != 'asyncio':
+        if uvloop is not None:
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+            logging.info('event loop: uvloop')
+            return 'uvloop'
+        if name == 'uvloop':
+            logging.warning('uvloop is not installed, falling back to asyncio')
+    asyncio.set_event_loop_policy(asyncio.DefaultEventLoopPolicy())
+    logging.info('event loop: asyncio')
+    return 'asyncio'
@@ -0,0 +1,120 @@
+import argparse, asyncio, importlib, logging, os, pkgutil, sys
+from typing import Iterable, List, Optional
+
+from core.db import Driver, create_driver
+from core.orm2 import Model, get_driver, use_driver
+
+
+def models(package: str = 'model') -> list:
+    '''
+    Every Model subclass defined in the modules of package.
+    '''
+    pkg = importlib.import_module(package)
+    for info in pkgutil.iter_modules(pkg.__path__):
+        importlib.import_module('%s.%s' % (package, info.name))
+    r, todo = [], list(Model.__subclasses__())
+    while todo:
+        cls = todo.pop(0)
+        if hasattr(cls, '__table__') and cls not in r:
+            r.append(cls)
+        todo.extend(cls.__subclasses__())
+    return r
+
+
+def column_sql(driver: Driver, model, name: str) -> str:
+    field = model.__mappings__[name]
+    if field.primary_key and field.column_type.lower().split('(')[0] in ('int', 'integer', 'bigint'):
+        return '`%s` %s' % (name, driver.auto_increment_sql(field.column_type))
+    sql = '`%s` %s' % (name, field.column_type)
+    if field.primary_key:
+        return sql + ' not null primary key'
+    return sql if field.nullable else sql + ' not null'
+
+
+def create_table_sql(driver: Driver, model) -> List[str]:
+    '''
+    create table statement of model, followed by its indexes.
+    '''
+    columns = [model.__primary_key__, *model.__fields__]
+    sql = ['create table if not exists `%s` (\n  %s\n)' % (
+        model.__table__, ',\n  '.join(column_sql(driver, model, c) for c in columns))]
+    for name, index_columns, unique in model.__index_list__:
+        sql.append(driver.add_index_sql(model.__table__, name, index_columns, unique))
+    return sql
+
+
+async def diff(model, driver: Optional[Driver] = None) -> List[str]:
+    '''
+    Statements bringing the database in line with model: the table when it is
+    missing, else the missing columns and indexes. Nothing is ever dropped;
+    columns and indexes the model does not declare are only logged.
+    '''
+    driver = driver or get_driver()
+    if model.__table__ not in await driver.tables():
+        return create_table_sql(driver, model)
+    sql = []
+    existing = await driver.columns(model.__table__)
+    for name in model.__fields__:
+        if name not in existing:
+            sql.append('alter table `%s` add column %s' % (model.__table__, column_sql(driver, model, name)))
+    for name in existing:
+        if name not in model.__mappings__:
+            logging.info('column %s.%s is not declared on %s' % (model.__table__, name, model.__name__))
+    indexes = await driver.indexes(model.__table__)
+    declared = set()
+    for name, columns, unique in model.__index_list__:
+        declared.add((columns, unique))
+        if (columns, unique) not in indexes.values():
+            sql.append(driver.add_index_sql(model.__table__, name, columns, unique))
+    for name, (columns, unique) in indexes.items():
+        if (columns, unique) not in declared:
+            logging.info('index %s%s on %s is not declared on %s' % (
+                name, columns, model.__table__, model.__name__))
+    return sql
+
+
+async def migrate(targets: Iterable, apply: bool = False, driver: Optional[Driver] = None) -> List[str]:
+    '''
+    diff() of every model; with apply the statements are executed in order.
+    '''
+    driver = driver or get_driver()
+    sql = []
+    for model in targets:
+        sql.extend(await diff(model, driver))
+    if apply:
+        for statement in sql:
+            logging.info('migrate: %s' % statement)
+            await driver.execute(statement, ())
+    return sql
+
+
+async def create_all(targets: Iterable, driver: Optional[Driver] = None) -> List[str]:
+    '''
+    Create the missing tables, columns and indexes of targets.
+    '''
+    return await migrate(targets, apply=True, driver=driver)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Print (or apply) the DDL bringing the database in line '
+                                                 'with the models')
+    parser.add_argument('--package', default='model')
+    parser.add_argument('--apply', action='store_true', help='execute the statements')
+    args = parser.parse_args(argv)
+    sys.path.insert(0, os.getcwd())
+    from config import configs
+
+    async def _main():
+        driver = await create_driver(**configs.db)
+        use_driver(driver)
+        try:
+            sql = await migrate(models(args.package), apply=args.apply, driver=driver)
+        finally:
+            await driver.close()
+        for statement in sql:
+            print('%s;' % statement)
+    asyncio.run(_main())
+
+
+if __name__ == '__main__':
+    main()
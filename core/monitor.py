@@ -0,0 +1,157 @@
+import asyncio, logging, sys, threading, time, traceback, weakref
+from bisect import bisect_left
+from collections import deque
+from typing import Optional, Tuple
+
+from aiohttp import web
+
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# task -> 'METHOD /path' of the request the task is serving
+_task_routes = weakref.WeakKeyDictionary()
+
+_monitor = None
+
+
+class LoopMonitor:
+    '''
+    Measure event loop lag with a periodic probe and watch for stalls from a
+    separate thread, so blocking code can be reported while it still blocks.
+    '''
+    def __init__(self, interval: float = 0.1, threshold: float = 0.1,
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS, max_stalls: int = 100):
+        self._interval = interval
+        self._threshold = threshold
+        self._buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self._buckets) + 1)
+        self._count = 0
+        self._sum = 0.0
+        self._max = 0.0
+        self._stalls = deque(maxlen=max_stalls)
+        self._loop = None
+        self._loop_thread_id = None
+        self._heartbeat = time.monotonic()
+        self._reported = None
+        self._probe_task = None
+        self._watchdog = None
+        self._stopped = threading.Event()
+
+    def observe(self, lag: float):
+        self._counts[bisect_left(self._buckets, lag)] += 1
+        self._count += 1
+        self._sum += lag
+        if lag > self._max:
+            self._max = lag
+
+    def histogram(self) -> dict:
+        buckets = dict()
+        total = 0
+        for le, n in zip(self._buckets, self._counts):
+            total += n
+            buckets[str(le)] = total
+        buckets['+Inf'] = self._count
+        return dict(buckets=buckets, count=self._count, sum=self._sum, max=self._max)
+
+    def stalls(self) -> list:
+        return list(self._stalls)
+
+    def start(self):
+        self._loop = asyncio.get_event_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._probe_task = self._loop.create_task(self._probe())
+        self._watchdog = threading.Thread(target=self._watch, name='loop-monitor', daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stopped.set()
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            try:
+                await self._probe_task
+            except asyncio.CancelledError:
+                pass
+        if self._watchdog is not None:
+            # the watchdog wakes up every interval / 2: join it off the loop
+            await asyncio.get_event_loop().run_in_executor(None, self._watchdog.join, self._interval)
+
+    async def _probe(self):
+        loop = self._loop
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self._interval)
+            lag = loop.time() - start - self._interval
+            self.observe(lag if lag > 0 else 0.0)
+            self._heartbeat = time.monotonic()
+
+    def _watch(self):
+        while not self._stopped.wait(self._interval / 2):
+            heartbeat = self._heartbeat
+            blocked = time.monotonic() - heartbeat - self._interval
+            if blocked < self._threshold or self._reported == heartbeat:
+                continue
+            # report each stall once, while the loop thread is still inside it
+            self._reported = heartbeat
+            self._report(blocked)
+
+    def _report(self, blocked: float):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack = ''.join(traceback.format_stack(frame)) if frame is not None else ''
+        route = None
+        try:
+            task = asyncio.current_task(self._loop)
+        except RuntimeError:
+            task = None
+        if task is not None:
+            route = _task_routes.get(task)
+        self._stalls.append(dict(time=time.time(), blocked=blocked, route=route, stack=stack))
+        logging.warning('event loop blocked for more than %.3fs (route: %s)\n%s' % (blocked, route, stack))
+
+
+@web.middleware
+async def monitor_middleware(request, handler):
+    task = asyncio.current_task()
+    if task is not None:
+        _task_routes[task] = '%s %s' % (request.method, request.path)
+    try:
+        return await handler(request)
+    finally:
+        if task is not None:
+            _task_routes.pop(task, None)
+
+
+def create_monitor(**kw):
+    async def _create_monitor(app):
+        global _monitor
+        _monitor = LoopMonitor(
+            interval=kw.get('interval', 0.1),
+            threshold=kw.get('threshold', 0.1),
+            max_stalls=kw.get('max_stalls', 100)
+        )
+        _monitor.start()
+        app['__loop_monitor__'] = _monitor
+        logging.info('loop monitor started, threshold: %ss' % _monitor._threshold)
+        yield
+        await app['__loop_monitor__'].stop()
+    return _create_monitor
+
+
+async def loop_stats(request):
+    monitor: Optional[LoopMonitor] = request.app.get('__loop_monitor__')
+    if monitor is None:
+        return web.json_response(dict(error='loop monitor is not running'), status=503)
+    return web.json_response(dict(lag=monitor.histogram(), stalls=monitor.stalls()))
+
+
+def add_monitor(app, **kw):
+    '''
+    Run a LoopMonitor for the app. Its stats, stack traces included, are only
+    served at kw['path'] with kw['expose'] (e.g. in debug mode).
+    '''
+    app.cleanup_ctx.append(create_monitor(**kw))
+    path = kw.get('path', None)
+    if path and kw.get('expose', False):
+        app.router.add_get(path, loop_stats)
+        logging.info('add loop monitor %s' % path)
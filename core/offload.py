@@ -0,0 +1,133 @@
+import asyncio, functools, importlib, logging, multiprocessing, os, pickle
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Optional
+
+from core.limiter import Overloaded
+
+
+class PoolSaturated(Overloaded):
+    pass
+
+
+POOLS = ('thread', 'process')
+
+_executors: Dict[str, Optional[Executor]] = dict(thread=None, process=None)
+# bounds the calls submitted to each pool: its workers plus max_pending queued
+_slots: Dict[str, Optional[asyncio.Semaphore]] = dict(thread=None, process=None)
+_wait_timeout: Optional[float] = 1.0
+# the process pool is only started by its first call: (workers, max_pending)
+_process_config: Optional[tuple] = None
+
+
+def _call_wrapped(module: str, qualname: str, args: tuple, kw: dict):
+    '''
+    Runs in the worker process: @offload replaced the module attribute with
+    its wrapper, so the function is looked up by name and unwrapped here.
+    '''
+    fn = importlib.import_module(module)
+    for name in qualname.split('.'):
+        fn = getattr(fn, name)
+    return getattr(fn, '__wrapped__', fn)(*args, **kw)
+
+
+async def run_in_pool(pool: str, fn, *args, **kw):
+    '''
+    Run fn(*args, **kw) in the managed thread or process pool. When the pool
+    and its queue are full for longer than wait_timeout, raise PoolSaturated,
+    which the request handler turns into a 503.
+    '''
+    executor = _executors.get(pool)
+    if executor is None and pool == 'process' and _process_config is not None:
+        executor = _start_process_pool()
+    if executor is None:
+        raise RuntimeError('%s pool is not running' % pool)
+    call = functools.partial(fn, *args, **kw)
+    if pool == 'process':
+        try:
+            pickle.dumps(call)
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            raise TypeError('%s and its arguments must be picklable to run in the process pool: %s' % (
+                getattr(fn, '__qualname__', fn), e))
+    slots = _slots[pool]
+    try:
+        await asyncio.wait_for(slots.acquire(), _wait_timeout)
+    except asyncio.TimeoutError:
+        raise PoolSaturated('%s pool is saturated' % pool)
+    try:
+        return await asyncio.get_event_loop().run_in_executor(executor, call)
+    finally:
+        slots.release()
+
+
+def offload(pool: str = 'thread'):
+    '''
+    Make a plain function awaitable, running in the managed pool:
+
+        @offload('process')
+        def hash_password(password): ...
+
+        digest = await hash_password(password)
+
+    For the process pool decorate module level functions, so they can be
+    found by name in the worker processes.
+    '''
+    if pool not in POOLS:
+        raise ValueError('Invalid pool value: %s' % pool)
+
+    def decorator(fn):
+        if asyncio.iscoroutinefunction(fn):
+            raise TypeError('@offload needs a plain function, got coroutine function %s' % fn.__qualname__)
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kw):
+            if pool == 'process':
+                return await run_in_pool(pool, _call_wrapped, fn.__module__, fn.__qualname__, args, kw)
+            return await run_in_pool(pool, fn, *args, **kw)
+        wrapper.__offload__ = pool
+        return wrapper
+    return decorator
+
+
+def process_context():
+    '''
+    Start method for worker processes: forking the running server would copy
+    its loop, open sockets and held locks into the child, so they are started
+    by a fork server (spawned where there is none).
+    '''
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def _start_process_pool() -> Executor:
+    workers, max_pending = _process_config
+    _executors['process'] = ProcessPoolExecutor(max_workers=workers, mp_context=process_context())
+    _slots['process'] = asyncio.Semaphore(workers + max_pending)
+    logging.info('offload process pool started with %s processes' % workers)
+    return _executors['process']
+
+
+def create_executors(**kw):
+    '''
+    Cleanup context running the pools used by @offload and run_in_pool(). The
+    process pool is started on its first use, so workers that never offload to
+    it do not pay for it.
+    '''
+    async def _create_executors(app):
+        global _wait_timeout, _process_config
+        thread_workers = kw.get('thread_workers', None) or min(32, (os.cpu_count() or 1) + 4)
+        process_workers = kw.get('process_workers', None) or os.cpu_count() or 1
+        max_pending = kw.get('max_pending', 64)
+        _wait_timeout = kw.get('wait_timeout', 1.0)
+        _executors['thread'] = ThreadPoolExecutor(max_workers=thread_workers, thread_name_prefix='offload')
+        _slots['thread'] = asyncio.Semaphore(thread_workers + max_pending)
+        _process_config = (process_workers, max_pending)
+        app['__executors__'] = _executors
+        logging.info('offload pools: %s threads, up to %s processes' % (thread_workers, process_workers))
+        yield
+        _process_config = None
+        loop = asyncio.get_event_loop()
+        for pool in POOLS:
+            executor, _executors[pool], _slots[pool] = _executors[pool], None, None
+            if executor is not None:
+                await loop.run_in_executor(None, executor.shutdown, True)
+    return _create_executors
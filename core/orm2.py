@@ -1,9 +1,13 @@
-import logging
+import importlib, logging, re, time
 from datetime import datetime
 from typing import Optional, Callable, Union, Dict, List, Tuple
-import aiomysql
 from enum import Enum
 
+from core.db import Driver, MySQLDriver, create_driver
+from core.deadline import check_deadline, remaining
+from core.explain import PlanChecker
+from core.singleflight import SingleFlight
+
 
 class Op(Enum):
     And = 'and'
@@ -24,58 +28,177 @@ def log(sql):
     logging.info('SQL: %s' % sql)
 
 
+_driver: Optional[Driver] = None
+# identical selects in flight at the same time share one query when enabled
+_coalesce = False
+_select_flight = SingleFlight()
+# EXPLAINs new select shapes when enabled, see create_pool
+_plan_checker: Optional[PlanChecker] = None
+
+
 def create_pool(**kw):
+    '''
+    Cleanup context connecting the ORM to the database in kw['driver']
+    ('mysql' by default, or 'sqlite' with db set to a file or ':memory:').
+    kw['coalesce'] makes concurrent identical selects share one query, and
+    kw['explain'] (debug mode) checks the plan of every new select shape.
+    kw['last_modified_ttl'] is how often Model.last_modified() re-reads the
+    table.
+    '''
     async def _create_pool(app):
-        global _mysql_pool
-        _mysql_pool = await aiomysql.create_pool(
-            host=kw.get('host', 'localhost'),
-            port=kw.get('port', 3306),
-            user=kw['user'],
-            password=kw['password'],
-            db=kw['db'],
-            charset=kw.get('charset', 'utf8'),
-            autocommit=kw.get('autocommit', True),
-            maxsize=kw.get('maxsize', 10),
-            minsize=kw.get('minsize', 1)
-        )
-        app['__mysql_pool__'] = _mysql_pool
+        global _driver, _coalesce, _plan_checker, _last_modified_ttl
+        _driver = await create_driver(**kw)
+        _coalesce = kw.get('coalesce', False)
+        _last_modified_ttl = kw.get('last_modified_ttl', 60.0)
+        _plan_checker = PlanChecker(_driver) if kw.get('explain', False) else None
+        app['__db__'] = _driver
+        if isinstance(_driver, MySQLDriver):
+            app['__mysql_pool__'] = _driver.pool
         yield
-        app['__mysql_pool__'].close()
-        await app['__mysql_pool__'].wait_closed()
+        if _plan_checker is not None:
+            await _plan_checker.close()
+            _plan_checker = None
+        await app['__db__'].close()
     return _create_pool
 
 
+def use_driver(driver: Optional[Driver]):
+    global _driver
+    _driver = driver
+
+
+def get_driver() -> Driver:
+    if _driver is None:
+        raise RuntimeError('database is not connected')
+    return _driver
+
+
+# called with (table, keys) after the Model write paths change rows; keys is
+# None when the rows are not known (update_cls)
+_write_listeners = []
+
+
+def on_write(fn: Callable[[str, Optional[list]], None]):
+    _write_listeners.append(fn)
+
+
+def off_write(fn: Callable[[str, Optional[list]], None]):
+    try:
+        _write_listeners.remove(fn)
+    except ValueError:
+        pass
+
+
+def notify_write(table: str, keys: Optional[list] = None):
+    for fn in _write_listeners:
+        try:
+            fn(table, keys)
+        except Exception:
+            logging.exception('write listener failed for %s' % table)
+
+
+# table -> validator returned by Model.last_modified(): max(updated_at),
+# moved by every write seen here (deletes included) in between, and read
+# again every _last_modified_ttl seconds for writes made elsewhere
+_last_modified: Dict[str, datetime] = dict()
+# table -> time.monotonic() of the last read of max(updated_at)
+_last_modified_read: Dict[str, float] = dict()
+_last_modified_ttl = 60.0
+# tables changed before this process started are not known to be unchanged
+_started = datetime.now().replace(microsecond=0)
+
+
+def touch(table: str, keys: Optional[list] = None):
+    '''
+    Record a change of table ('*' for every table) for Model.last_modified(),
+    for writes the ORM does not see (raw SQL, other processes through the
+    invalidation bus).
+    '''
+    now = datetime.now()
+    if table == '*':
+        for name in list(_last_modified):
+            _last_modified[name] = now
+    else:
+        _last_modified[table] = now
+
+
+on_write(touch)
+
+
+def _timed_sql(sql: str) -> str:
+    left = remaining()
+    return sql if left is None else _driver.with_timeout(sql, left)
+
+
 async def select(sql: str, args: Optional[tuple] = None, size: Optional[int] = None):
-    args = args or ()
-    global _mysql_pool
-    async with _mysql_pool.acquire() as conn:
-        async with conn.cursor(aiomysql.DictCursor) as cur:
-            await cur.execute(sql.replace('?', '%s'), args)
-            if size:
-                res = await cur.fetchmany(size)
-            else:
-                res = await cur.fetchall()
+    args = tuple(args or ())
+    check_deadline()
+    if _plan_checker is not None:
+        _plan_checker.check(sql, args)
+    if _coalesce:
+        try:
+            key = (sql, args, size)
+            hash(key)
+        except TypeError:
+            key = None
+        if key is not None:
+            # no timeout hint: the query is shared, one caller's deadline must
+            # not fail the others, each of which still stops waiting at its own
+            res = await _select_flight.do(key, lambda: _driver.select(sql, args, size))
+            # the rows are shared by every caller of the flight: each gets
+            # copies it may change
+            res = [dict(row) for row in res]
             logging.info('rows returned: %s' % len(res))
             return res
+    res = await _driver.select(_timed_sql(sql), args, size)
+    logging.info('rows returned: %s' % len(res))
+    return res
 
 
 async def execute(sql: str, args: Optional[tuple] = None):
     args = args or ()
-    global _mysql_pool
-    async with _mysql_pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute(sql.replace('?', '%s'), args)
-            affected = cur.rowcount
-            return affected
+    check_deadline()
+    return await _driver.execute(sql, args)
 
 
 async def insert(sql: str, args: Optional[tuple] = None):
     args = args or ()
-    global _mysql_pool
-    async with _mysql_pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute(sql.replace('?', '%s'), args)
-            return cur.lastrowid
+    check_deadline()
+    return await _driver.insert(sql, args)
+
+
+async def iterate(sql: str, args: Optional[tuple] = None, batch: int = 1000):
+    '''
+    Stream rows of a select without loading the whole result.
+    '''
+    args = args or ()
+    async for row in _driver.iterate(sql, args, batch):
+        yield row
+
+
+_order_term = re.compile(r'^`?(\w+)`?(\s+(asc|desc))?$', re.I)
+
+
+def _qualify_order(order_by: str, alias: str) -> str:
+    terms = []
+    for term in order_by.split(','):
+        m = _order_term.match(term.strip())
+        if m is None:
+            raise ValueError('Invalid order_by for a joined query: %s' % order_by)
+        terms.append('%s.`%s`%s' % (alias, m.group(1), m.group(2) or ''))
+    return ', '.join(terms)
+
+
+# (table, column) pairs already reported by _warn_unindexed
+_unindexed = set()
+
+
+def _warn_unindexed(cls, column: str):
+    key = (cls.__table__, column)
+    if key in _unindexed:
+        return
+    _unindexed.add(key)
+    logging.warning('where on unindexed column %s.%s, declare an index for it (index=True or __indexes__)' % key)
 
 
 def create_args_string(num):
@@ -87,11 +210,15 @@ def create_args_string(num):
 
 class Field(object):
 
-    def __init__(self, name: Optional[str], column_type: str, primary_key: bool, default):
+    def __init__(self, name: Optional[str], column_type: str, primary_key: bool, default, nullable: bool = True,
+                 index: bool = False, unique: bool = False):
         self.name = name
         self.column_type = column_type
         self.primary_key = primary_key
         self.default = default
+        self.nullable = nullable
+        self.index = index
+        self.unique = unique
 
     def __str__(self):
         return '<%s, %s:%s>' % (self.__class__.__name__, self.column_type, self.name)
@@ -99,8 +226,9 @@ class Field(object):
 
 class StringField(Field):
 
-    def __init__(self, name=None, primary_key=False, default=None, ddl='varchar(100)'):
-        super().__init__(name, ddl, primary_key, default)
+    def __init__(self, name=None, primary_key=False, default=None, ddl='varchar(100)', nullable=True,
+                 index=False, unique=False):
+        super().__init__(name, ddl, primary_key, default, nullable, index, unique)
 
 
 class BooleanField(Field):
@@ -111,26 +239,107 @@ class BooleanField(Field):
 
 class IntegerField(Field):
 
-    def __init__(self, name=None, primary_key=False, default=None, ddl='bigint'):
-        super().__init__(name, ddl, primary_key, default)
+    def __init__(self, name=None, primary_key=False, default=None, ddl='bigint', nullable=True,
+                 index=False, unique=False):
+        super().__init__(name, ddl, primary_key, default, nullable, index, unique)
 
 
 class FloatField(Field):
 
-    def __init__(self, name=None, primary_key=False, default: Union[float, Callable[[], float]] = None):
-        super().__init__(name, 'real', primary_key, default)
+    def __init__(self, name=None, primary_key=False, default: Union[float, Callable[[], float]] = None,
+                 nullable=True):
+        super().__init__(name, 'real', primary_key, default, nullable)
 
 
 class TextField(Field):
 
-    def __init__(self, name=None, default=None):
-        super().__init__(name, 'text', False, default)
+    def __init__(self, name=None, default=None, nullable=True):
+        super().__init__(name, 'text', False, default, nullable)
 
 
 class DateTimeField(Field):
 
-    def __init__(self, name=None, default: Union[float, Callable[[], float]] = None):
-        super().__init__(name, 'datetime', False, default)
+    def __init__(self, name=None, default: Union[float, Callable[[], float]] = None, index=False):
+        super().__init__(name, 'datetime', False, default, index=index)
+
+
+def _index_list(table_name: str, primary_key: str, mappings: dict, attrs: dict) -> List[Tuple[str, tuple, bool]]:
+    '''
+    (name, columns, unique) of the indexes declared with index=True or
+    unique=True on a field, or in __indexes__ / __unique__ as tuples of
+    column names for composite ones.
+    '''
+    declared = []
+    for k, v in mappings.items():
+        if not v.primary_key and (v.index or v.unique):
+            declared.append(((k,), v.unique))
+    declared.extend((tuple(columns), False) for columns in attrs.get('__indexes__', ()))
+    declared.extend((tuple(columns), True) for columns in attrs.get('__unique__', ()))
+    r = []
+    for columns, unique in declared:
+        for c in columns:
+            if c not in mappings:
+                raise RuntimeError('Index on unknown field: %s.%s' % (table_name, c))
+        r.append(('%s_%s_%s' % ('uk' if unique else 'idx', table_name, '_'.join(columns)), columns, unique))
+    return r
+
+
+class Relation(object):
+    '''
+    Declared on a model as a class attribute; the model is a class or its
+    dotted path ('model.blog.BlogModel'), resolved on first use so models can
+    refer to each other. Loaded with findall(include=...), with only the
+    related columns in attributes (plus the keys) when it is given.
+    '''
+    many = False
+
+    def __init__(self, model, foreign_key: str, attributes: Optional[List[str]] = None):
+        self._model = model
+        self.foreign_key = foreign_key
+        self.attributes = attributes
+
+    @property
+    def model(self):
+        if isinstance(self._model, str):
+            module, name = self._model.rsplit('.', 1)
+            self._model = getattr(importlib.import_module(module), name)
+        return self._model
+
+    def keys(self, owner) -> Tuple[str, str]:
+        '''
+        (column of the owner, column of the related model) joined on.
+        '''
+        raise NotImplementedError
+
+    def columns(self, owner) -> List[str]:
+        '''
+        Columns of the related model to load.
+        '''
+        target = self.model
+        if not self.attributes:
+            return [target.__primary_key__, *target.__fields__]
+        return list(dict.fromkeys([target.__primary_key__, self.keys(owner)[1], *self.attributes]))
+
+
+class HasMany(Relation):
+    '''
+    One-to-many: foreign_key is the column of the related model holding the
+    owner's primary key. Loads as a list.
+    '''
+    many = True
+
+    def keys(self, owner) -> Tuple[str, str]:
+        return owner.__primary_key__, self.foreign_key
+
+
+class BelongsTo(Relation):
+    '''
+    Many-to-one: foreign_key is the owner's column holding the related
+    model's primary key; it gets an index unless one is declared. Loads as
+    one model or None.
+    '''
+    def keys(self, owner) -> Tuple[str, str]:
+        return self.foreign_key, self.model.__primary_key__
 
 
 class ModelMetaclass(type):
@@ -139,12 +348,15 @@ class ModelMetaclass(type):
         if name == 'Model':
             return type.__new__(mcs, name, bases, attrs)
         attrs['__slots__'] = []
-        attrs['__dict__'] = {}
         table_name = attrs.get('__table__', None) or name
         mappings = dict()
+        relations = dict()
         fields = []
         primary_key = None
         for k, v in attrs.items():
+            if isinstance(v, Relation):
+                attrs['__slots__'].append(k)
+                relations[k] = v
             if isinstance(v, Field):
                 attrs['__slots__'].append(k)
                 mappings[k] = v
@@ -156,8 +368,15 @@ class ModelMetaclass(type):
                     fields.append(k)
         if not primary_key:
             raise RuntimeError('Primary key not found.')
-        for k in mappings.keys():
+        for k in [*mappings.keys(), *relations.keys()]:
             attrs.pop(k)
+        for k, v in relations.items():
+            if isinstance(v, BelongsTo):
+                if v.foreign_key not in mappings:
+                    raise RuntimeError('Foreign key not found for relation %s: %s' % (k, v.foreign_key))
+                field = mappings[v.foreign_key]
+                if not field.index and not field.unique:
+                    field.index = True
 
         model = list(filter(lambda b: b is Model, bases))[0]
         attrs['__exist_created_at__'] = True if model.__created_at__ in fields else False
@@ -175,7 +394,10 @@ class ModelMetaclass(type):
                 fields.append(model.__updated_at__)
 
         escaped_fields = list(map(lambda x: '`%s`' % x, fields))
+        attrs['__index_list__'] = _index_list(table_name, primary_key, mappings, attrs)
+        attrs['__indexed__'] = set([primary_key, *(columns[0] for _, columns, _ in attrs['__index_list__'])])
         attrs['__mappings__'] = mappings  # 保存属性和列的映射关系
+        attrs['__relations__'] = relations
         attrs['__table__'] = table_name
         attrs['__primary_key__'] = primary_key  # 主键属性名
         attrs['__fields__'] = fields  # 除主键外的属性名
@@ -187,7 +409,12 @@ class ModelMetaclass(type):
         attrs['__update__'] = 'update `%s` set %s where `%s`=?' % (
             table_name, ', '.join(map(lambda f: '`%s`=?' % (mappings.get(f).name or f), fields)), primary_key)
         attrs['__delete__'] = 'delete from `%s` where `%s`=?' % (table_name, primary_key)
-        return type.__new__(mcs, name, bases, attrs)
+        # __slots__ only lists the allowed attribute names: set after class
+        # creation, values stay in each instance's own __dict__
+        slots = attrs.pop('__slots__')
+        cls = type.__new__(mcs, name, bases, attrs)
+        cls.__slots__ = slots
+        return cls
 
 
 WhereType = Dict[Union[str, Op], Union[int, str, float, tuple, List[Union[tuple, dict]]]]
@@ -234,7 +461,7 @@ class Model(metaclass=ModelMetaclass):
         return value
 
     async def update(self):
-        actual_fields = list(filter(lambda k: k != self.__primary_key__, self.__dict__.keys()))
+        actual_fields = list(filter(lambda k: k != self.__primary_key__ and k in self.__mappings__, self.__dict__.keys()))
         args = list(map(self.get_value, actual_fields))
         if self.__timestamps__ is True:
             if self.__updated_at__ and self.__updated_at__ not in actual_fields:
@@ -250,6 +477,8 @@ class Model(metaclass=ModelMetaclass):
         affected = await execute(sql, tuple(args))
         if affected != 1:
             logging.warning('failed to update by primary key: affected rows: %s' % affected)
+        if affected:
+            notify_write(self.__table__, [self.get_value(self.__primary_key__)])
         return affected
 
     @classmethod
@@ -275,6 +504,8 @@ class Model(metaclass=ModelMetaclass):
         else:
             raise ValueError('Invalid data value: %s' % str(data))
         affected = await execute(' '.join(sql), tuple(args))
+        if affected:
+            notify_write(cls.__table__)
         return affected
 
     @classmethod
@@ -316,8 +547,19 @@ class Model(metaclass=ModelMetaclass):
         last_rowid = await insert(self.__insert__, args)
         if last_rowid < 1:
             logging.warning('failed to insert record: %s' % str(self.__dict__))
+        else:
+            notify_write(self.__table__, [self.get_value(self.__primary_key__) or last_rowid])
         return last_rowid
 
+    async def remove(self):
+        pk = self.get_value(self.__primary_key__)
+        affected = await execute(self.__delete__, (pk,))
+        if affected != 1:
+            logging.warning('failed to remove by primary key: affected rows: %s' % affected)
+        if affected:
+            notify_write(self.__table__, [pk])
+        return affected
+
     @classmethod
     async def findall(
         cls,
@@ -325,8 +567,21 @@ class Model(metaclass=ModelMetaclass):
         attributes: Optional[FieldListType] = None,
         order_by: Optional[str] = None,
         limit: Optional[Tuple[int, int]] = None,
-        raw: bool = False
+        raw: bool = False,
+        include: Optional[Union[List[str], Dict[str, str]]] = None
     ) -> list:
+        '''
+        include names relations to load with the rows, as a list (loaded
+        'select_in': one extra `where key in (...)` query per relation) or a
+        dict of name -> 'select_in' or 'joined' (left joined into the same
+        query, at most one HasMany per query).
+        '''
+        include = cls._check_include(include)
+        if include and attributes:
+            attributes = list(attributes)
+            for key in [cls.__primary_key__, *(cls.__relations__[name].keys(cls)[0] for name in include)]:
+                if key not in attributes:
+                    attributes.append(key)
         sql_l = [cls.__select__]
         if attributes:
             if isinstance(attributes, list):
@@ -341,11 +596,153 @@ class Model(metaclass=ModelMetaclass):
             order_by=order_by,
             limit=limit
         )
-        rs = await select(' '.join(sql_l), tuple(args_l))
+        joined = [name for name, strategy in include.items() if strategy == 'joined']
+        if joined:
+            rs = await cls._select_joined(' '.join(sql_l), tuple(args_l), attributes, order_by, joined)
+        else:
+            rs = await select(' '.join(sql_l), tuple(args_l))
+        for name, strategy in include.items():
+            if strategy == 'select_in':
+                rs = await cls._select_in(rs, name)
         if raw is True:
             return [r for r in rs]
+        if include:
+            return [cls._from_row(r, include) for r in rs]
         return [cls(**r) for r in rs]
 
+    @classmethod
+    def _check_include(cls, include) -> Dict[str, str]:
+        if not include:
+            return {}
+        if isinstance(include, (list, tuple)):
+            include = dict((name, 'select_in') for name in include)
+        if not isinstance(include, dict):
+            raise ValueError('Invalid include value: %s' % str(include))
+        for name, strategy in include.items():
+            if name not in cls.__relations__:
+                raise ValueError('%s has no relation %s' % (cls.__name__, name))
+            if strategy not in ('select_in', 'joined'):
+                raise ValueError('Invalid strategy for %s: %s' % (name, strategy))
+        if sum(1 for name, s in include.items() if s == 'joined' and cls.__relations__[name].many) > 1:
+            raise ValueError('Only one HasMany relation can be joined per query')
+        return include
+
+    @classmethod
+    def _from_row(cls, row: dict, include: Dict[str, str]):
+        obj = cls(**row)
+        for name in include:
+            relation = cls.__relations__[name]
+            value = row[name]
+            if relation.many:
+                obj[name] = [relation.model(**r) for r in value]
+            else:
+                obj[name] = relation.model(**value) if value is not None else None
+        return obj
+
+    @classmethod
+    async def _select_in(cls, rows: list, name: str, chunk: int = 500) -> list:
+        '''
+        rows as new dicts carrying the relation name: rows from select() may
+        be shared with other callers and are not changed.
+        '''
+        relation = cls.__relations__[name]
+        target = relation.model
+        local, remote = relation.keys(cls)
+        values = list(dict.fromkeys(r[local] for r in rows if r[local] is not None))
+        columns = ', '.join('`%s`' % c for c in relation.columns(cls))
+        related = []
+        for i in range(0, len(values), chunk):
+            part = values[i:i + chunk]
+            related.extend(await select('select %s from `%s` where `%s` in (%s)' % (
+                columns, target.__table__, remote, create_args_string(len(part))), tuple(part)))
+        if relation.many:
+            groups = dict()
+            for r in related:
+                groups.setdefault(r[remote], []).append(r)
+            return [dict(r, **{name: [dict(c) for c in groups.get(r[local], [])]}) for r in rows]
+        by_key = dict((r[remote], r) for r in related)
+        return [dict(r, **{name: dict(by_key[r[local]]) if r[local] in by_key else None}) for r in rows]
+
+    @classmethod
+    async def _select_joined(cls, sql: str, args: tuple, attributes: Optional[list], order_by: Optional[str],
+                             names: List[str]) -> list:
+        '''
+        The parents' own select (with its where, order and limit) becomes a
+        derived table t0 the relations are left joined to, so limit counts
+        parents, not joined rows.
+        '''
+        columns = [('t0', c) for c in (attributes or [cls.__primary_key__, *cls.__fields__])]
+        joins = []
+        for i, name in enumerate(names, 1):
+            relation = cls.__relations__[name]
+            target = relation.model
+            local, remote = relation.keys(cls)
+            columns.extend(('t%d' % i, c) for c in relation.columns(cls))
+            joins.append('left join `%s` as t%d on t%d.`%s` = t0.`%s`' % (target.__table__, i, i, remote, local))
+        sql_l = ['select %s from (%s) as t0' % (
+            ', '.join('%s.`%s` as `%s__%s`' % (t, c, t, c) for t, c in columns), sql), *joins]
+        if order_by:
+            sql_l.append('order by %s' % _qualify_order(order_by, 't0'))
+        rs = await select(' '.join(sql_l), args)
+        parents = dict()
+        for row in rs:
+            split = dict()
+            for (t, c) in columns:
+                split.setdefault(t, {})[c] = row['%s__%s' % (t, c)]
+            key = split['t0'][cls.__primary_key__]
+            parent = parents.get(key)
+            if parent is None:
+                parent = parents[key] = split['t0']
+                for name in names:
+                    parent[name] = [] if cls.__relations__[name].many else None
+            for i, name in enumerate(names, 1):
+                relation = cls.__relations__[name]
+                child = split['t%d' % i]
+                if child[relation.model.__primary_key__] is None:
+                    continue
+                if relation.many:
+                    # one HasMany per query: each row carries a different child
+                    parent[name].append(child)
+                else:
+                    parent[name] = child
+        return list(parents.values())
+
+    @classmethod
+    async def last_modified(cls, where: Optional[WhereType] = None) -> Optional[datetime]:
+        '''
+        When the table last changed: the latest updated_at, moved by every
+        write through the ORM, deletes included, or by touch(), and read again
+        after last_modified_ttl seconds for writes this process does not see.
+        Never before this process started. With where, the latest updated_at of
+        the matching rows (a query each time, None when there are none).
+        '''
+        if not cls.__updated_at__ or cls.__updated_at__ not in cls.__fields__:
+            raise ValueError('%s has no %s column' % (cls.__name__, cls.__updated_at__))
+        now = time.monotonic()
+        if where is None:
+            value = _last_modified.get(cls.__table__)
+            read = _last_modified_read.get(cls.__table__)
+            if value is not None and read is not None and now - read < _last_modified_ttl:
+                return value
+        sql_l, args_l = cls._make_sql_and_args(
+            sql_l=['select max(`%s`) as `last_modified` from `%s`' % (cls.__updated_at__, cls.__table__)],
+            args_l=[],
+            where=where
+        )
+        rs = await select(' '.join(sql_l), tuple(args_l), 1)
+        value = rs[0]['last_modified'] if rs else None
+        if isinstance(value, str):
+            # aggregates lose the column type on sqlite
+            value = datetime.fromisoformat(value)
+        if where is not None:
+            return value
+        # deletes and writes while the query ran may have set a newer value
+        value = max(value, _started) if value else _started
+        value = max(value, _last_modified.get(cls.__table__, value))
+        _last_modified[cls.__table__] = value
+        _last_modified_read[cls.__table__] = now
+        return value
+
     # where = {'name': 'luu', 'time': [(Op.Gt, '2020-09-01'), (Op.Lt, '2020-09-02')]}
     @classmethod
     def _make_sql_and_args(
@@ -361,6 +758,8 @@ class Model(metaclass=ModelMetaclass):
         err_msg = 'Invalid where value: %s' % str(where)
         if where and isinstance(where, dict):
             for k, v in where.items():
+                if isinstance(k, str) and k not in cls.__indexed__:
+                    _warn_unindexed(cls, k)
                 if isinstance(k, str) and isinstance(v, tuple):
                     cls._op_condition(k, v, sql_l, args_l, err_msg)
                 elif isinstance(k, str) and (isinstance(v, int) or isinstance(v, str) or isinstance(v, float)):
@@ -0,0 +1,106 @@
+import logging
+from typing import Dict, List, Optional
+
+from aiohttp import web
+from aiohttp.web_exceptions import HTTPMethodNotAllowed, HTTPNotFound
+from aiohttp.web_urldispatcher import DynamicResource, MatchInfoError, PlainResource
+
+
+class _Node:
+    __slots__ = ('children', 'resources')
+
+    def __init__(self):
+        self.children: Dict[str, '_Node'] = dict()
+        # (registration order, resource) of dynamic resources whose static prefix ends here
+        self.resources = []
+
+
+def _static_prefix(formatter: str) -> List[str]:
+    '''
+    Path segments of formatter before the first one holding a {variable}.
+    '''
+    prefix = formatter[:formatter.find('{')]
+    return prefix.split('/')[1:-1]
+
+
+class RadixRouter(web.UrlDispatcher):
+    '''
+    UrlDispatcher that resolves through a table compiled when the app is
+    frozen, instead of trying every resource in turn: plain paths are looked
+    up in a dict and dynamic paths are narrowed down by a radix tree over
+    their static prefix. Other resources (static, sub apps) are always tried.
+    Candidates are still tried in registration order, so the first matching
+    route wins exactly as with the default router.
+    '''
+    def __init__(self):
+        super().__init__()
+        self._plain: Optional[Dict[str, list]] = None
+        self._tree: Optional[_Node] = None
+        self._fallback = []
+        # path -> candidate resources of paths that matched a route, bounded
+        # by cache_size
+        self._cache: Dict[str, tuple] = dict()
+        self.cache_size = 4096
+
+    def freeze(self):
+        super().freeze()
+        self.compile()
+
+    def compile(self):
+        plain = dict()
+        tree = _Node()
+        fallback = []
+        for order, resource in enumerate(self._resources):
+            if type(resource) is PlainResource:
+                plain.setdefault(resource.canonical, []).append((order, resource))
+            elif type(resource) is DynamicResource:
+                node = tree
+                for segment in _static_prefix(resource.canonical):
+                    node = node.children.setdefault(segment, _Node())
+                node.resources.append((order, resource))
+            else:
+                fallback.append((order, resource))
+        self._plain = plain
+        self._tree = tree
+        self._fallback = fallback
+        self._cache.clear()
+        plain_count = sum(map(len, plain.values()))
+        logging.info('radix router: %s plain, %s dynamic, %s other resources' % (
+            plain_count, len(self._resources) - plain_count - len(fallback), len(fallback)))
+
+    def candidates(self, path: str) -> tuple:
+        cached = self._cache.get(path)
+        if cached is not None:
+            return cached
+        found = list(self._plain.get(path, ()))
+        node = self._tree
+        found.extend(node.resources)
+        for segment in path.split('/')[1:]:
+            node = node.children.get(segment)
+            if node is None:
+                break
+            found.extend(node.resources)
+        found.extend(self._fallback)
+        if len(found) > 1:
+            found.sort(key=lambda item: item[0])
+        return tuple(resource for _, resource in found)
+
+    async def resolve(self, request):
+        if self._plain is None:
+            return await super().resolve(request)
+        allowed_methods = set()
+        # decoded like UrlDispatcher does, so percent-encoded paths match too
+        path = request.rel_url.path_safe
+        candidates = self.candidates(path)
+        for resource in candidates:
+            match_dict, allowed = await resource.resolve(request)
+            if match_dict is not None:
+                # 404s are not cached: a scan of random urls must not fill
+                # it before the routes in use get in
+                if path not in self._cache and len(self._cache) < self.cache_size:
+                    self._cache[path] = candidates
+                return match_dict
+            allowed_methods |= allowed
+        if allowed_methods:
+            return MatchInfoError(HTTPMethodNotAllowed(request.method, allowed_methods))
+        return MatchInfoError(HTTPNotFound())
@@ -0,0 +1,206 @@
+import logging, os, signal, socket, time
+from multiprocessing import RawArray
+from typing import Callable, Dict, Optional, Union
+
+from aiohttp import web
+
+
+STAT_FIELDS = ('requests', 'errors', 'active')
+
+# shared with the workers, STAT_FIELDS per slot
+_stats = None
+_slot: Optional[int] = None
+
+
+def _stat_index(slot: int, field: str) -> int:
+    return slot * len(STAT_FIELDS) + STAT_FIELDS.index(field)
+
+
+@web.middleware
+async def stats_middleware(request, handler):
+    base = _slot * len(STAT_FIELDS)
+    _stats[base] += 1
+    _stats[base + 2] += 1
+    try:
+        response = await handler(request)
+    except Exception:
+        _stats[base + 1] += 1
+        raise
+    finally:
+        _stats[base + 2] -= 1
+    if response.status >= 500:
+        _stats[base + 1] += 1
+    return response
+
+
+def _bind(host: str, port: int, reuse_port: bool = False) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(1024)
+    sock.set_inheritable(True)
+    return sock
+
+
+class Master:
+    '''
+    Prefork master: workers serve a socket bound here and inherited on fork,
+    or with reuse_port each bind their own SO_REUSEPORT socket. Crashed
+    workers are restarted, SIGHUP replaces every worker gracefully (new ones
+    are started before the old ones drain, after calling on_reload; a SIGHUP
+    while old workers still drain is applied after they are gone), SIGUSR1
+    logs aggregated stats and SIGTERM/SIGINT drain and stop.
+    '''
+    def __init__(self, app: Union[web.Application, Callable[[], web.Application]], host: str = '0.0.0.0',
+                 port: int = 8080, workers: Optional[int] = None, reuse_port: bool = False,
+                 shutdown_timeout: float = 60.0, on_reload: Optional[Callable[[], None]] = None, **kw):
+        global _stats
+        self._app = app
+        self._host = host
+        self._port = port
+        self._workers = workers or os.cpu_count() or 1
+        self._reuse_port = reuse_port
+        self._shutdown_timeout = shutdown_timeout
+        self._on_reload = on_reload
+        self._sock = None
+        # slot -> pid; twice the workers so a reload can overlap old and new generations
+        self._pids: Dict[int, int] = dict()
+        self._started: Dict[int, float] = dict()
+        self._retiring = set()
+        self._stopping = False
+        self._reload = False
+        self._dump = False
+        _stats = RawArray('q', self._workers * 2 * len(STAT_FIELDS))
+
+    def run(self):
+        if not self._reuse_port:
+            self._sock = _bind(self._host, self._port)
+        logging.info('master %s listening on %s:%s with %s workers' % (
+            os.getpid(), self._host, self._port, self._workers))
+        signal.signal(signal.SIGHUP, lambda *_: setattr(self, '_reload', True))
+        signal.signal(signal.SIGUSR1, lambda *_: setattr(self, '_dump', True))
+        signal.signal(signal.SIGTERM, lambda *_: setattr(self, '_stopping', True))
+        signal.signal(signal.SIGINT, lambda *_: setattr(self, '_stopping', True))
+        for _ in range(self._workers):
+            self._spawn()
+        try:
+            while not self._stopping:
+                self._reap()
+                # a reload during a reload waits until the old generation
+                # has drained, so at most two generations share the slots
+                if self._reload and not self._retiring:
+                    self._reload = False
+                    self._graceful_reload()
+                if self._dump:
+                    self._dump = False
+                    logging.info('worker stats: %s' % self.stats())
+                active = len(self._pids) - len(self._retiring)
+                for _ in range(self._workers - active):
+                    self._spawn()
+                time.sleep(0.2)
+        finally:
+            self._shutdown()
+
+    def stats(self) -> dict:
+        total = dict.fromkeys(STAT_FIELDS, 0)
+        workers = dict()
+        for slot, pid in self._pids.items():
+            values = dict((field, _stats[_stat_index(slot, field)]) for field in STAT_FIELDS)
+            workers[pid] = values
+            for field in STAT_FIELDS:
+                total[field] += values[field]
+        return dict(total=total, workers=workers)
+
+    def _spawn(self):
+        slot = next((i for i in range(self._workers * 2) if i not in self._pids), None)
+        if slot is None:
+            logging.warning('no free worker slot, not starting a worker')
+            return
+        for field in STAT_FIELDS:
+            _stats[_stat_index(slot, field)] = 0
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                self._run_worker(slot)
+            except Exception:
+                logging.exception('worker %s failed' % os.getpid())
+                code = 1
+            finally:
+                os._exit(code)
+        self._pids[slot] = pid
+        self._started[slot] = time.monotonic()
+        logging.info('started worker %s in slot %s' % (pid, slot))
+
+    def _run_worker(self, slot: int):
+        global _slot
+        _slot = slot
+        for sig in (signal.SIGHUP, signal.SIGUSR1, signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, signal.SIG_DFL)
+        app = self._app() if callable(self._app) and not isinstance(self._app, web.Application) else self._app
+        app.middlewares.insert(0, stats_middleware)
+        sock = _bind(self._host, self._port, True) if self._reuse_port else self._sock
+        web.run_app(app, sock=sock, shutdown_timeout=self._shutdown_timeout, print=None)
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            slot = next((s for s, p in self._pids.items() if p == pid), None)
+            if slot is None:
+                continue
+            del self._pids[slot]
+            started = self._started.pop(slot)
+            if slot in self._retiring:
+                self._retiring.discard(slot)
+                logging.info('worker %s drained' % pid)
+                continue
+            if self._stopping:
+                continue
+            logging.warning('worker %s exited unexpectedly with status %s, restarting' % (pid, status))
+            if time.monotonic() - started < 1:
+                # crash loop: don't respawn faster than once a second
+                time.sleep(1)
+
+    def _graceful_reload(self):
+        logging.info('reloading workers')
+        if self._on_reload is not None:
+            # e.g. re-read the config, so the new workers fork with it
+            self._on_reload()
+        old = [s for s in self._pids if s not in self._retiring]
+        for _ in range(self._workers):
+            self._spawn()
+        for slot in old:
+            self._retiring.add(slot)
+            os.kill(self._pids[slot], signal.SIGTERM)
+
+    def _shutdown(self):
+        logging.info('stopping workers')
+        for slot, pid in self._pids.items():
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + self._shutdown_timeout + 5
+        while self._pids and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        for pid in self._pids.values():
+            os.kill(pid, signal.SIGKILL)
+        if self._sock is not None:
+            self._sock.close()
+
+
+def run_workers(app, **kw):
+    '''
+    Serve app (an Application, or a factory called in each worker) from
+    several processes. Cleanup contexts such as create_pool run in every
+    worker, so each worker gets its own connection pool.
+    '''
+    Master(app, **kw).run()
@@ -0,0 +1,213 @@
+import base64, hashlib, hmac, logging, secrets, time
+from typing import Optional
+
+from aiohttp import web
+
+from core.cache import LRUCache
+
+
+class Session(dict):
+    '''
+    Session data, a dict that remembers whether it was changed.
+    '''
+    def __init__(self, sid: str, data: Optional[dict] = None, new: bool = False):
+        super(Session, self).__init__(data or {})
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.invalidated = False
+        # stored sid dropped by rotate()
+        self.replaced: Optional[str] = None
+
+    def __setitem__(self, key, value):
+        super(Session, self).__setitem__(key, value)
+        self.modified = True
+
+    def __delitem__(self, key):
+        super(Session, self).__delitem__(key)
+        self.modified = True
+
+    def pop(self, key, *args):
+        self.modified = self.modified or key in self
+        return super(Session, self).pop(key, *args)
+
+    def update(self, *args, **kw):
+        super(Session, self).update(*args, **kw)
+        self.modified = True
+
+    def clear(self):
+        super(Session, self).clear()
+        self.modified = True
+
+    def invalidate(self):
+        '''
+        Drop the session: its data is deleted and the cookie cleared.
+        '''
+        super(Session, self).clear()
+        self.invalidated = True
+
+    def rotate(self):
+        '''
+        Move the data to a new session id and delete the old one. Call it when
+        the session gains privileges (login), so an id planted on the client
+        beforehand is worthless.
+        '''
+        if not self.new and self.replaced is None:
+            self.replaced = self.sid
+        self.sid = secrets.token_urlsafe(24)
+        self.new = True
+        self.modified = True
+
+
+class SessionStore:
+    '''
+    Server-side session storage. Backends implement load/save/delete; data
+    is a plain dict, ttl is in seconds.
+    '''
+    async def load(self, sid: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def save(self, sid: str, data: dict, ttl: int):
+        raise NotImplementedError
+
+    async def delete(self, sid: str):
+        raise NotImplementedError
+
+
+class MemoryStore(SessionStore):
+    '''
+    Sessions kept in this process only: with several workers use a shared
+    backend behind CachedStore instead.
+    '''
+    def __init__(self, maxsize: int = 10000):
+        self._cache = LRUCache(maxsize=maxsize)
+
+    async def load(self, sid: str) -> Optional[dict]:
+        return self._cache.get(sid)
+
+    async def save(self, sid: str, data: dict, ttl: int):
+        self._cache.set(sid, data, ttl)
+
+    async def delete(self, sid: str):
+        self._cache.delete(sid)
+
+
+class CachedStore(SessionStore):
+    '''
+    In-memory LRU in front of a shared backend; reads hit the backend only on
+    a miss, writes go to both.
+    '''
+    def __init__(self, backend: SessionStore, maxsize: int = 10000, ttl: Optional[float] = 60):
+        self.backend = backend
+        self._cache = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    async def load(self, sid: str) -> Optional[dict]:
+        data = self._cache.get(sid)
+        if data is None:
+            data = await self.backend.load(sid)
+            if data is not None:
+                self._cache.set(sid, data)
+        return data
+
+    async def save(self, sid: str, data: dict, ttl: int):
+        await self.backend.save(sid, data, ttl)
+        self._cache.set(sid, data)
+
+    async def delete(self, sid: str):
+        self._cache.delete(sid)
+        await self.backend.delete(sid)
+
+
+def _sign(secret: bytes, value: str) -> str:
+    digest = hmac.new(secret, value.encode('utf-8'), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).decode('ascii').rstrip('=')
+
+
+def sign_sid(secret: bytes, sid: str) -> str:
+    value = '%s.%d' % (sid, int(time.time()))
+    return '%s.%s' % (value, _sign(secret, value))
+
+
+def unsign_sid(secret: bytes, cookie: str, max_age: Optional[int] = None) -> Optional[str]:
+    '''
+    The session id from a cookie made by sign_sid(), None when the signature
+    does not match or it is older than max_age.
+    '''
+    try:
+        value, signature = cookie.rsplit('.', 1)
+        sid, issued = value.rsplit('.', 1)
+        issued = int(issued)
+    except ValueError:
+        return None
+    if not hmac.compare_digest(signature, _sign(secret, value)):
+        return None
+    if max_age is not None and issued + max_age < time.time():
+        return None
+    return sid
+
+
+async def get_session(request) -> Session:
+    '''
+    The request's session, loaded on first use: requests that never call
+    this cost no cookie check and no store lookup.
+    '''
+    session = request.get('__session__')
+    if session is not None:
+        return session
+    options = request['__session_options__']
+    sid = None
+    cookie = request.cookies.get(options['cookie_name'])
+    if cookie:
+        sid = unsign_sid(options['secret'], cookie, options['max_age'])
+    data = await options['store'].load(sid) if sid else None
+    if data is None:
+        session = Session(secrets.token_urlsafe(24), new=True)
+    else:
+        session = Session(sid, data)
+    request['__session__'] = session
+    return session
+
+
+def session_middleware(**kw):
+    '''
+    Signed cookie sessions with server-side data: the cookie only carries the
+    session id signed with kw['secret']. The data lives in kw['store'] (a
+    SessionStore), by default a MemoryStore of kw['maxsize'] sessions.
+    '''
+    secret = kw['secret']
+    options = dict(
+        secret=secret.encode('utf-8') if isinstance(secret, str) else secret,
+        cookie_name=kw.get('cookie_name', 'EDOSESSION'),
+        max_age=kw.get('max_age', 86400),
+        store=kw.get('store', None) or MemoryStore(kw.get('maxsize', 10000))
+    )
+    cookie_options = dict(
+        max_age=options['max_age'],
+        path=kw.get('path', '/'),
+        httponly=kw.get('httponly', True),
+        secure=kw.get('secure', False) or None,
+        samesite=kw.get('samesite', 'Lax')
+    )
+
+    @web.middleware
+    async def _session_middleware(request, handler):
+        request['__session_options__'] = options
+        response = await handler(request)
+        session = request.get('__session__')
+        if session is None:
+            return response
+        if response.prepared:
+            if session.modified or session.invalidated:
+                logging.warning('session changed after the response was sent: %s' % request.path)
+            return response
+        if session.replaced is not None:
+            await options['store'].delete(session.replaced)
+        if session.invalidated:
+            if not session.new:
+                await options['store'].delete(session.sid)
+            response.del_cookie(options['cookie_name'], path=cookie_options['path'])
+        elif session.modified:
+            await options['store'].save(session.sid, dict(session), options['max_age'])
+            response.set_cookie(options['cookie_name'], sign_sid(options['secret'], session.sid), **cookie_options)
+        return response
+    return _session_middleware
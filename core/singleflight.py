@@ -0,0 +1,31 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    '''
+    Run at most one call per key at a time: callers arriving while a call for
+    the same key is in flight await its result (or exception) instead of
+    starting their own. The result object is shared between all of them.
+    '''
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = dict()
+
+    def __len__(self):
+        return len(self._calls)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable]):
+        fut = self._calls.get(key)
+        if fut is None:
+            # a task of its own, so a cancelled caller does not cancel the others
+            fut = asyncio.ensure_future(fn())
+            self._calls[key] = fut
+            fut.add_done_callback(lambda f: self._forget(key, f))
+        return await asyncio.shield(fut)
+
+    def _forget(self, key: Hashable, fut: asyncio.Future):
+        if self._calls.get(key) is fut:
+            del self._calls[key]
+        if not fut.cancelled():
+            # mark the exception retrieved when every caller has gone away
+            fut.exception()
@@ -0,0 +1,161 @@
+import gzip, hashlib, logging, mimetypes, os, re
+from typing import Dict, Optional
+
+from aiohttp import web
+
+from core.compress import negotiate
+from core.function import etag_matches, add_template_global
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# sibling suffix -> Content-Encoding, in order of preference
+ENCODINGS = (('.br', 'br'), ('.gz', 'gzip'))
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'application/xml', 'image/svg+xml')
+
+_hashed_name_re = re.compile(r'^(?P<stem>.+)\.(?P<hash>[0-9a-f]{8,})(?P<ext>\.[^./]+)$')
+
+
+class StaticEntry:
+    __slots__ = ('path', 'hash', 'content_type', 'encodings', 'bodies')
+
+    def __init__(self, path: str, hash: str, content_type: str, encodings: Dict[str, str]):
+        self.path = path
+        self.hash = hash
+        self.content_type = content_type
+        self.encodings = encodings
+        # encoding (None for identity) -> bytes, for files small enough to keep in memory
+        self.bodies: Dict[Optional[str], bytes] = dict()
+
+
+class StaticFiles:
+    '''
+    Manifest of the files under a static directory, built once at startup.
+    Files are addressed by their relative path or by a hashed name such as
+    css/easydo.0123abcd.css, which is cached by clients as immutable.
+    '''
+    def __init__(self, root: str, prefix: str = '/static/', hash_length: int = 12, max_age: int = 31536000,
+                 precompress: bool = False, min_size: int = 512, memory_limit: int = 1048576):
+        self.root = os.path.abspath(root)
+        self.prefix = prefix if prefix.endswith('/') else prefix + '/'
+        self.hash_length = hash_length
+        self.max_age = max_age
+        self.precompress = precompress
+        self.min_size = min_size
+        self.memory_limit = memory_limit
+        self.files: Dict[str, StaticEntry] = dict()
+
+    def build(self):
+        files = dict()
+        for root, dirs, names in os.walk(self.root):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            for name in names:
+                if name.startswith('.') or name.endswith(('.gz', '.br')):
+                    continue
+                path = os.path.join(root, name)
+                rel = os.path.relpath(path, self.root).replace(os.sep, '/')
+                with open(path, 'rb') as f:
+                    data = f.read()
+                content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+                if self.precompress and len(data) >= self.min_size and content_type.startswith(COMPRESSIBLE_TYPES):
+                    _write_compressed(path, data)
+                encodings = dict()
+                for suffix, encoding in ENCODINGS:
+                    if os.path.isfile(path + suffix) and os.path.getmtime(path + suffix) >= os.path.getmtime(path):
+                        encodings[encoding] = path + suffix
+                digest = hashlib.md5(data).hexdigest()[:self.hash_length]
+                entry = StaticEntry(path, digest, content_type, encodings)
+                if len(data) <= self.memory_limit:
+                    entry.bodies[None] = data
+                    for encoding, compressed_path in encodings.items():
+                        with open(compressed_path, 'rb') as f:
+                            entry.bodies[encoding] = f.read()
+                files[rel] = entry
+        self.files = files
+        logging.info('static manifest: %s files under %s' % (len(files), self.root))
+        return self
+
+    def url(self, rel: str) -> str:
+        rel = rel.lstrip('/')
+        entry = self.files.get(rel)
+        if entry is None:
+            return self.prefix + rel
+        stem, ext = os.path.splitext(rel)
+        return '%s%s.%s%s' % (self.prefix, stem, entry.hash, ext)
+
+    def lookup(self, name: str):
+        '''
+        Return (entry, immutable) for a requested relative name.
+        '''
+        entry = self.files.get(name)
+        if entry is not None:
+            return entry, False
+        m = _hashed_name_re.match(name)
+        if m:
+            entry = self.files.get(m.group('stem') + m.group('ext'))
+            if entry is not None and entry.hash == m.group('hash'):
+                return entry, True
+        return None, False
+
+    async def handle(self, request):
+        entry, immutable = self.lookup(request.match_info['filename'])
+        if entry is None:
+            # returned, not raised: middleware1 turns raised errors into 200s
+            return web.HTTPNotFound()
+        chosen = negotiate(request.headers.get('Accept-Encoding', ''),
+                           [encoding for _, encoding in ENCODINGS if encoding in entry.encodings])
+        # each encoding is a different representation: it gets its own etag
+        etag = '"%s-%s"' % (entry.hash, chosen) if chosen else '"%s"' % entry.hash
+        headers = {
+            'ETag': etag,
+            'Vary': 'Accept-Encoding',
+            'Cache-Control': 'public, max-age=%s, immutable' % self.max_age if immutable else 'no-cache'
+        }
+        if etag_matches(request.headers.get('If-None-Match'), etag):
+            return web.Response(status=304, headers=headers)
+        path = entry.path
+        if chosen is not None:
+            path = entry.encodings[chosen]
+            headers['Content-Encoding'] = chosen
+        headers['Content-Type'] = entry.content_type
+        body = entry.bodies.get(chosen)
+        if body is not None:
+            return web.Response(body=body, headers=headers)
+        return web.FileResponse(path, headers=headers)
+
+
+def _write_compressed(path: str, data: bytes):
+    mtime = os.path.getmtime(path)
+    targets = [('.gz', lambda d: gzip.compress(d, compresslevel=9))]
+    if brotli is not None:
+        targets.append(('.br', lambda d: brotli.compress(d, quality=11)))
+    for suffix, compress in targets:
+        target = path + suffix
+        if os.path.isfile(target) and os.path.getmtime(target) >= mtime:
+            continue
+        with open(target, 'wb') as f:
+            f.write(compress(data))
+
+
+_static: Optional[StaticFiles] = None
+
+
+def static_url(rel: str) -> str:
+    '''
+    Cache-busting url of a static file, for use in templates: {{ static_url('css/easydo.css') }}
+    '''
+    if _static is None:
+        return '/static/' + rel.lstrip('/')
+    return _static.url(rel)
+
+
+def setup_static(app, path: str, prefix: str = '/static/', **kw) -> StaticFiles:
+    global _static
+    _static = StaticFiles(path, prefix=prefix, **kw).build()
+    app.router.add_get(_static.prefix + '{filename:.+}', _static.handle)
+    app['__static__'] = _static
+    add_template_global('static_url', static_url)
+    return _static
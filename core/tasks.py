@@ -0,0 +1,167 @@
+import asyncio, functools, logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from core.offload import process_context
+
+
+class TaskQueueFull(Exception):
+    pass
+
+
+class _Job:
+    __slots__ = ('fn', 'args', 'kw', 'retries', 'backoff', 'cpu')
+
+    def __init__(self, fn, args, kw, retries, backoff, cpu):
+        self.fn = fn
+        self.args = args
+        self.kw = kw
+        self.retries = retries
+        self.backoff = backoff
+        self.cpu = cpu
+
+
+class TaskQueue:
+    '''
+    In-process background jobs: a bounded queue consumed by a pool of asyncio
+    worker tasks. Coroutine functions run on the loop, plain functions in the
+    default thread executor, and cpu=True jobs in a process pool (which needs
+    process_workers > 0 and picklable functions and arguments). Failed jobs
+    are retried with exponential backoff.
+    '''
+    def __init__(self, workers: int = 4, maxsize: int = 1000, retries: int = 3, backoff: float = 0.5,
+                 max_backoff: float = 30.0, process_workers: int = 0):
+        self._workers = workers
+        self._maxsize = maxsize
+        self._retries = retries
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._process_workers = process_workers
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks = []
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        self._closed = False
+        self.processed = 0
+        self.failed = 0
+        self.retried = 0
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def start(self):
+        self._queue = asyncio.Queue(self._maxsize)
+        if self._process_workers:
+            self._process_pool = ProcessPoolExecutor(max_workers=self._process_workers, mp_context=process_context())
+        self._tasks = [asyncio.ensure_future(self._work()) for _ in range(self._workers)]
+        logging.info('task queue started with %s workers' % self._workers)
+
+    async def stop(self, drain_timeout: float = 30.0):
+        '''
+        Stop accepting jobs, wait up to drain_timeout for queued ones, then
+        cancel whatever is left.
+        '''
+        self._closed = True
+        try:
+            await asyncio.wait_for(self._queue.join(), drain_timeout)
+        except asyncio.TimeoutError:
+            logging.warning('task queue drain timed out, dropping %s jobs' % self._queue.qsize())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._process_pool is not None:
+            await asyncio.get_event_loop().run_in_executor(None, self._process_pool.shutdown, True)
+
+    def _job(self, fn, args, kw, retries, backoff, cpu) -> _Job:
+        if self._closed or self._queue is None:
+            raise RuntimeError('task queue is not running')
+        if cpu and self._process_pool is None:
+            raise ValueError('cpu jobs need process_workers > 0')
+        return _Job(fn, args, kw, self._retries if retries is None else retries,
+                    self._backoff if backoff is None else backoff, cpu)
+
+    def submit(self, fn, *args, retries: Optional[int] = None, backoff: Optional[float] = None,
+               cpu: bool = False, **kw):
+        '''
+        Queue fn(*args, **kw) and return at once; raise TaskQueueFull when the
+        queue is full.
+        '''
+        try:
+            self._queue.put_nowait(self._job(fn, args, kw, retries, backoff, cpu))
+        except asyncio.QueueFull:
+            raise TaskQueueFull('task queue is full: %s jobs' % self._maxsize)
+
+    async def enqueue(self, fn, *args, retries: Optional[int] = None, backoff: Optional[float] = None,
+                      cpu: bool = False, **kw):
+        '''
+        Like submit(), but wait for room in the queue.
+        '''
+        await self._queue.put(self._job(fn, args, kw, retries, backoff, cpu))
+
+    async def _run(self, job: _Job):
+        if job.cpu:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(self._process_pool, functools.partial(job.fn, *job.args, **job.kw))
+        if asyncio.iscoroutinefunction(job.fn):
+            return await job.fn(*job.args, **job.kw)
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, functools.partial(job.fn, *job.args, **job.kw))
+
+    async def _work(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                for attempt in range(job.retries + 1):
+                    try:
+                        await self._run(job)
+                        self.processed += 1
+                        break
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception:
+                        if attempt == job.retries:
+                            self.failed += 1
+                            logging.exception('background job %s failed after %s attempts' % (
+                                getattr(job.fn, '__name__', job.fn), attempt + 1))
+                            break
+                        self.retried += 1
+                        await asyncio.sleep(min(self._max_backoff, job.backoff * 2 ** attempt))
+            finally:
+                self._queue.task_done()
+
+
+_queue: Optional[TaskQueue] = None
+
+
+def create_task_queue(**kw):
+    '''
+    Cleanup context running a TaskQueue for the lifetime of the app; queued
+    jobs are drained on shutdown.
+    '''
+    async def _create_task_queue(app):
+        global _queue
+        queue = TaskQueue(
+            workers=kw.get('workers', 4),
+            maxsize=kw.get('maxsize', 1000),
+            retries=kw.get('retries', 3),
+            backoff=kw.get('backoff', 0.5),
+            max_backoff=kw.get('max_backoff', 30.0),
+            process_workers=kw.get('process_workers', 0)
+        )
+        await queue.start()
+        _queue = queue
+        app['__tasks__'] = queue
+        yield
+        await queue.stop(kw.get('drain_timeout', 30.0))
+        if _queue is queue:
+            _queue = None
+    return _create_task_queue
+
+
+def background(fn, *args, **kw):
+    '''
+    Run fn(*args, **kw) after the response, on the app's task queue.
+    '''
+    if _queue is None:
+        raise RuntimeError('task queue is not running')
+    _queue.submit(fn, *args, **kw)
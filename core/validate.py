@@ -0,0 +1,148 @@
+import inspect, re, typing
+from typing import Callable, Dict, Optional, Tuple
+
+# integer column types -> bits
+_INT_RANGES = dict(
+    tinyint=8,
+    smallint=16,
+    mediumint=24,
+    int=32,
+    integer=32,
+    bigint=64
+)
+_TRUE = ('1', 'true', 'yes', 'on')
+_FALSE = ('0', 'false', 'no', 'off')
+
+
+class ValidationError(ValueError):
+    def __init__(self, name: str, message: str):
+        super(ValidationError, self).__init__('Invalid argument %s: %s' % (name, message))
+        self.name = name
+
+
+class Rule:
+    '''
+    What is known about one argument: its type, length and range limits and
+    whether it may be null. Built from an annotation and/or a Model field.
+    '''
+    __slots__ = ('type', 'max_length', 'min_value', 'max_value', 'nullable')
+
+    def __init__(self):
+        self.type = None
+        self.max_length = None
+        self.min_value = None
+        self.max_value = None
+        self.nullable = True
+
+
+def _from_annotation(rule: Rule, annotation):
+    if annotation is inspect.Parameter.empty:
+        return
+    if typing.get_origin(annotation) is typing.Union:
+        args = [a for a in typing.get_args(annotation) if a is not type(None)]
+        if len(args) != 1:
+            return
+        annotation = args[0]
+    if annotation in (int, float, bool, str):
+        rule.type = annotation
+
+
+def _from_ddl(rule: Rule, field):
+    ddl = field.column_type.lower()
+    m = re.match(r'(var)?char\((\d+)\)', ddl)
+    if m:
+        rule.type = rule.type or str
+        rule.max_length = int(m.group(2))
+    m = re.match(r'(tinyint|smallint|mediumint|integer|int|bigint)\b', ddl)
+    if m and ddl != 'tinyint(1)':
+        bits = _INT_RANGES[m.group(1)]
+        rule.type = rule.type or int
+        if 'unsigned' in ddl:
+            rule.min_value, rule.max_value = 0, 2 ** bits - 1
+        else:
+            rule.min_value, rule.max_value = -2 ** (bits - 1), 2 ** (bits - 1) - 1
+    elif ddl in ('boolean', 'bool', 'tinyint(1)'):
+        rule.type = rule.type or bool
+    elif ddl.startswith(('real', 'float', 'double', 'decimal')):
+        rule.type = rule.type or float
+    rule.nullable = getattr(field, 'nullable', True) and not field.primary_key
+
+
+def _check(name: str, rule: Rule) -> Callable:
+    kind = rule.type
+    max_length = rule.max_length
+    min_value = rule.min_value
+    max_value = rule.max_value
+    nullable = rule.nullable
+
+    def check(value):
+        if value is None:
+            if not nullable:
+                raise ValidationError(name, 'must not be null')
+            return value
+        if kind is int:
+            if isinstance(value, bool) or isinstance(value, float) and not value.is_integer():
+                raise ValidationError(name, 'must be an integer')
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                raise ValidationError(name, 'must be an integer')
+        elif kind is float:
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                raise ValidationError(name, 'must be a number')
+        elif kind is bool:
+            if isinstance(value, str):
+                if value.lower() in _TRUE:
+                    value = True
+                elif value.lower() in _FALSE:
+                    value = False
+            if not isinstance(value, bool):
+                raise ValidationError(name, 'must be a boolean')
+        elif kind is str:
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                value = str(value)
+            elif not isinstance(value, str):
+                raise ValidationError(name, 'must be a string')
+        if max_length is not None and isinstance(value, str) and len(value) > max_length:
+            raise ValidationError(name, 'longer than %s characters' % max_length)
+        if isinstance(value, (int, float)):
+            if min_value is not None and value < min_value:
+                raise ValidationError(name, 'less than %s' % min_value)
+            if max_value is not None and value > max_value:
+                raise ValidationError(name, 'greater than %s' % max_value)
+        return value
+    return check
+
+
+def compile_validator(fn, schema=None) -> Optional[Callable[[dict], dict]]:
+    '''
+    A function checking and converting the keyword-only arguments of fn in a
+    dict of request params, from their annotations and, for names matching a
+    field of the schema Model, the field's DDL (varchar length, integer range,
+    nullable). Raises ValidationError; None when there is nothing to check.
+    '''
+    mappings = getattr(schema, '__mappings__', None) or {}
+    checks: Dict[str, Callable] = dict()
+    for name, param in inspect.signature(fn).parameters.items():
+        if param.kind != inspect.Parameter.KEYWORD_ONLY:
+            continue
+        rule = Rule()
+        field = mappings.get(name)
+        _from_annotation(rule, param.annotation)
+        if field is not None:
+            _from_ddl(rule, field)
+        if rule.type is None and rule.max_length is None and rule.nullable:
+            continue
+        checks[name] = _check(name, rule)
+    if not checks:
+        return None
+    items: Tuple[Tuple[str, Callable], ...] = tuple(checks.items())
+
+    def validate(kw: dict) -> dict:
+        for name, check in items:
+            if name in kw:
+                kw[name] = check(kw[name])
+        return kw
+    return validate
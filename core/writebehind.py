@@ -0,0 +1,289 @@
+import asyncio, logging
+from datetime import datetime
+from typing import Dict, Optional
+
+from core.orm2 import create_args_string, get_driver, notify_write
+
+
+class WriteBuffer:
+    '''
+    Write-behind buffer for hot rows: increments are summed and field sets
+    merged (last one wins) per model and primary key in memory, an increment
+    of a column set earlier added to the set value and a set replacing the
+    increments before it, then written every interval seconds, or as soon as
+    max_pending rows are waiting, as one batched statement per model:
+
+        update t set views = coalesce(views, 0) + case id when ? then ? ... end
+        where id in (...)
+
+    With upsert=True increments are written as insert ... on duplicate key
+    update (or on conflict) instead, creating missing rows, for counter
+    tables: every other column of the table then needs a default (or to be
+    nullable). Rows whose statement fails are retried on the next flushes, up
+    to retries times, then dropped. Buffered writes are lost if the process
+    dies before a flush.
+    '''
+    def __init__(self, interval: float = 1.0, max_pending: int = 1000, upsert: bool = False, chunk: int = 500,
+                 retries: int = 3):
+        self.interval = interval
+        self.max_pending = max_pending
+        self.upsert = upsert
+        self.chunk = chunk
+        self.retries = retries
+        # model -> pk -> column -> delta / value
+        self._increments: Dict[type, Dict] = dict()
+        self._sets: Dict[type, Dict] = dict()
+        self._pending = 0
+        # (buffer, model, pk) -> failed flushes
+        self._failures: Dict[tuple, int] = dict()
+        # one flush at a time, so writes of a row reach the database in order
+        self._lock = asyncio.Lock()
+        self._flushing: Optional[asyncio.Future] = None
+        self._stopping: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.flushed = 0
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _row(self, buffers: dict, model, pk) -> dict:
+        rows = buffers.setdefault(model, dict())
+        row = rows.get(pk)
+        if row is None:
+            row = rows[pk] = dict()
+            self._pending += 1
+        return row
+
+    def _drop(self, buffers: dict, model, pk):
+        rows = buffers[model]
+        del rows[pk]
+        if not rows:
+            del buffers[model]
+        self._pending -= 1
+
+    def _add(self, model, pk, deltas: dict):
+        # a column has either a buffered value or a buffered delta, never both,
+        # so sets and increments can be written in any order
+        values = self._sets.get(model, dict()).get(pk, dict())
+        for column, delta in deltas.items():
+            if column in values:
+                values[column] = (values[column] or 0) + delta
+            else:
+                row = self._row(self._increments, model, pk)
+                row[column] = row.get(column, 0) + delta
+
+    def increment(self, model, pk, **deltas):
+        for column in deltas:
+            if column not in model.__fields__:
+                raise ValueError('%s has no column %s' % (model.__name__, column))
+        self._add(model, pk, deltas)
+        self._check_size()
+
+    def set(self, model, pk, **values):
+        for column in values:
+            if column not in model.__fields__:
+                raise ValueError('%s has no column %s' % (model.__name__, column))
+        deltas = self._increments.get(model, dict()).get(pk)
+        if deltas:
+            for column in values:
+                deltas.pop(column, None)
+            if not deltas:
+                self._drop(self._increments, model, pk)
+        self._row(self._sets, model, pk).update(values)
+        self._check_size()
+
+    def _check_size(self):
+        if self._pending >= self.max_pending and (self._flushing is None or self._flushing.done()):
+            self._flushing = asyncio.ensure_future(self.flush())
+
+    async def flush(self):
+        '''
+        Write everything buffered so far, after any flush already running.
+        Rows whose statement fails are put back and retried on the next flush;
+        when the flush is cancelled, the rows of later statements are put back,
+        those of the statement in progress may have been written and are not.
+        '''
+        async with self._lock:
+            increments, sets = self._increments, self._sets
+            self._increments, self._sets, self._pending = dict(), dict(), 0
+            # the driver directly: a flush started from a request must not be
+            # bound by its deadline
+            driver = get_driver()
+            work = [('set', model, chunk) for model, rows in sets.items() for chunk in self._chunks(rows)]
+            work.extend(('increment', model, chunk) for model, rows in increments.items()
+                        for chunk in self._chunks(rows))
+            for i, (kind, model, chunk) in enumerate(work):
+                try:
+                    if kind == 'set':
+                        await driver.execute(*self._set_sql(model, chunk))
+                    else:
+                        await driver.execute(*self._increment_sql(driver, model, chunk))
+                except Exception:
+                    logging.exception('write-behind flush of %s failed' % model.__table__)
+                    self._retry(kind, model, chunk)
+                    continue
+                except BaseException:
+                    logging.warning('write-behind flush interrupted, %s of %s %s possibly applied' % (
+                        kind, model.__table__, list(chunk)))
+                    for kind, model, chunk in work[i + 1:]:
+                        self._merge(kind, model, chunk)
+                    raise
+                self.flushed += len(chunk)
+                for pk in chunk:
+                    self._failures.pop((kind, model, pk), None)
+                notify_write(model.__table__, list(chunk))
+
+    def _merge(self, kind: str, model, chunk: dict):
+        # put back unwritten rows underneath what was buffered since the swap
+        if kind == 'set':
+            for pk, values in chunk.items():
+                row = self._row(self._sets, model, pk)
+                deltas = self._increments.get(model, dict()).get(pk, dict())
+                for column, value in values.items():
+                    if column in row:
+                        # set again since the swap
+                        continue
+                    row[column] = (value or 0) + deltas.pop(column) if column in deltas else value
+                if pk in self._increments.get(model, dict()) and not deltas:
+                    self._drop(self._increments, model, pk)
+        else:
+            for pk, deltas in chunk.items():
+                values = self._sets.get(model, dict()).get(pk, dict())
+                # increments before a set since the swap are replaced by it
+                self._add(model, pk, {c: d for c, d in deltas.items() if c not in values})
+
+    def _retry(self, kind: str, model, chunk: dict):
+        retry, dropped = dict(), []
+        for pk, values in chunk.items():
+            key = (kind, model, pk)
+            failures = self._failures.get(key, 0) + 1
+            if failures > self.retries:
+                self._failures.pop(key, None)
+                dropped.append(pk)
+            else:
+                self._failures[key] = failures
+                retry[pk] = values
+        if dropped:
+            logging.error('write-behind: dropped buffered %ss of %s %s after %s failed flushes' % (
+                kind, model.__table__, dropped, self.retries + 1))
+        self._merge(kind, model, retry)
+
+    def _chunks(self, rows: dict):
+        items = list(rows.items())
+        for i in range(0, len(items), self.chunk):
+            yield dict(items[i:i + self.chunk])
+
+    def _case_sql(self, model, rows: dict, column: str, template: str, default: str):
+        args = []
+        whens = []
+        for pk, values in rows.items():
+            if column in values:
+                whens.append('when ? then ?')
+                args.extend((pk, values[column]))
+        sql = template % ('case `%s` %s else %s end' % (model.__primary_key__, ' '.join(whens), default))
+        return sql, args
+
+    def _update_sql(self, model, rows: dict, assignments: list, args: list):
+        if model.__updated_at__ and model.__updated_at__ in model.__fields__:
+            assignments.append('`%s` = ?' % model.__updated_at__)
+            args.append(datetime.now())
+        args.extend(rows)
+        sql = 'update `%s` set %s where `%s` in (%s)' % (
+            model.__table__, ', '.join(assignments), model.__primary_key__, create_args_string(len(rows)))
+        return sql, tuple(args)
+
+    def _set_sql(self, model, rows: dict):
+        columns = list(dict.fromkeys(c for values in rows.values() for c in values))
+        assignments, args = [], []
+        for column in columns:
+            sql, case_args = self._case_sql(model, rows, column, '`%s` = %%s' % column, '`%s`' % column)
+            assignments.append(sql)
+            args.extend(case_args)
+        return self._update_sql(model, rows, assignments, args)
+
+    def _increment_sql(self, driver, model, rows: dict):
+        columns = list(dict.fromkeys(c for deltas in rows.values() for c in deltas))
+        if self.upsert:
+            args = []
+            for pk, deltas in rows.items():
+                args.append(pk)
+                args.extend(deltas.get(c, 0) for c in columns)
+            return driver.upsert_increment_sql(model.__table__, model.__primary_key__, columns, len(rows)), tuple(args)
+        assignments, args = [], []
+        for column in columns:
+            sql, case_args = self._case_sql(
+                model, rows, column, '`%s` = coalesce(`%s`, 0) + %%s' % (column, column), '0')
+            assignments.append(sql)
+            args.extend(case_args)
+        return self._update_sql(model, rows, assignments, args)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+            if self._pending:
+                await self.flush()
+
+    def start(self):
+        self._stopping = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        # not cancelled: a flush in progress is finished, not cut off
+        if self._task is not None:
+            self._stopping.set()
+            await asyncio.gather(self._task, return_exceptions=True)
+        if self._flushing is not None:
+            await asyncio.gather(self._flushing, return_exceptions=True)
+        await self.flush()
+
+
+_buffer: Optional[WriteBuffer] = None
+
+
+def create_write_buffer(**kw):
+    '''
+    Cleanup context running a WriteBuffer for the lifetime of the app, with a
+    final flush on shutdown. Append it after create_pool, so it is flushed
+    before the pool closes.
+    '''
+    async def _create_write_buffer(app):
+        global _buffer
+        buffer = WriteBuffer(
+            interval=kw.get('interval', 1.0),
+            max_pending=kw.get('max_pending', 1000),
+            upsert=kw.get('upsert', False),
+            retries=kw.get('retries', 3)
+        )
+        buffer.start()
+        _buffer = buffer
+        app['__write_buffer__'] = buffer
+        yield
+        await buffer.stop()
+        if _buffer is buffer:
+            _buffer = None
+    return _create_write_buffer
+
+
+def _current() -> WriteBuffer:
+    if _buffer is None:
+        raise RuntimeError('write buffer is not running')
+    return _buffer
+
+
+def increment(model, pk, **deltas):
+    '''
+    Add deltas to columns of the row pk of model, written behind.
+    '''
+    _current().increment(model, pk, **deltas)
+
+
+def set_fields(model, pk, **values):
+    '''
+    Set columns of the row pk of model, written behind; the last value wins.
+    '''
+    _current().set(model, pk, **values)
@@ -0,0 +1,15 @@
+from core.orm2 import Model, BelongsTo, IntegerField, StringField, TextField, table
+
+
+@table(timestamps=True)
+class BlogModel(Model):
+    __table__ = 'blog'
+
+    id = IntegerField(primary_key=True)
+    user_id = IntegerField(nullable=False)
+    title = StringField(ddl='varchar(100)', nullable=False)
+    content = TextField()
+    views = IntegerField(default=0)
+
+    # the author as shown with a blog, never its password
+    user = BelongsTo('model.user.UserModel', 'user_id', attributes=['nickname'])
@@ -1,4 +1,7 @@
-from core.orm2 import Model, IntegerField, StringField, table
+import hashlib, hmac, os
+
+from core.offload import offload
+from core.orm2 import Model, HasMany, IntegerField, StringField, table
 
 
 @table(timestamps=True)
@@ -7,6 +10,30 @@ class UserModel(Model):
 
     id = IntegerField(primary_key=True)
     nickname = StringField(ddl='varchar(50)')
-    email = StringField(ddl='varchar(128)')
+    email = StringField(ddl='varchar(128)', index=True)
     password = StringField(ddl='varchar(255)')
-    openid = StringField(ddl='varchar(64)')
+    openid = StringField(ddl='varchar(64)', unique=True)
+
+    blogs = HasMany('model.blog.BlogModel', 'user_id')
+
+
+@offload('process')
+def hash_password(password: str, salt: bytes = None) -> str:
+    '''
+    pbkdf2 hash for the password column, run in the process pool:
+    await hash_password(password)
+    '''
+    salt = salt or os.urandom(16)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, 100000)
+    return '%s$%s' % (salt.hex(), digest.hex())
+
+
+@offload('process')
+def verify_password(password: str, hashed: str) -> bool:
+    try:
+        salt, digest = hashed.split('$', 1)
+        salt = bytes.fromhex(salt)
+    except ValueError:
+        return False
+    expected = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, 100000)
+    return hmac.compare_digest(expected.hex(), digest)